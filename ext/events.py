@@ -9,6 +9,17 @@ import disnake
 from disnake.ext import commands, tasks
 
 from utils.bot import Bot, Cog
+from utils.database import (
+    CLOSE_GROUPS_SQL,
+    EVENT_EXISTS_SQL,
+    REMOVE_EVENT_SQL,
+    SELECT_EVENTS_SQL,
+    SELECT_GROUP_ROLES_SQL,
+    SELECT_GROUPS_TO_CLOSE_SQL,
+    SELECT_REGISTRATION_CHANNEL_SQL,
+    SELECT_REGISTRATION_SQL,
+)
+from utils.trophies import trophy_thumbnails
 from utils.views import EventEndView
 
 
@@ -21,24 +32,13 @@ class EventManagement(Cog):
     async def groups_disabler(self):
         await self.bot.wait_until_ready()
         now = datetime.now()
-        data = await self.bot.db.fetchall(
-            "SELECT role_id, event_id FROM groups WHERE start_time < $1 AND closed = FALSE",
-            now,
-        )
+        data = await self.bot.db.fetchall(SELECT_GROUPS_TO_CLOSE_SQL, now, background=True)
         self.bot.log.info("Got %d groups to close", len(data))
         event_data = {}
         for row in data:
             id = row["event_id"]
             if id not in event_data:
-                event_data[id] = await self.bot.db.fetchrow(
-                    """
-                    SELECT
-                        registration_channel_id AS channel_id,
-                        registration_message_id AS message_id
-                    FROM events
-                    WHERE id = $1""",
-                    id,
-                )
+                event_data[id] = await self.bot.db.fetchrow(SELECT_REGISTRATION_SQL, id, background=True)
             channel = self.bot.get_channel(event_data[id]["channel_id"])
             msg = await channel.fetch_message(event_data[id]["message_id"])
             view = disnake.ui.View.from_message(msg)
@@ -49,7 +49,7 @@ class EventManagement(Cog):
                     self.bot.log.info("Group %s is no longer joinable", child.custom_id)
                     break
 
-        await self.bot.db.execute("UPDATE groups SET closed = TRUE WHERE start_time < $1", now)
+        await self.bot.db.execute(CLOSE_GROUPS_SQL, now, background=True)
 
     @Cog.listener()
     async def on_button_click(self, inter: disnake.MessageInteraction):
@@ -137,7 +137,7 @@ class EventManagement(Cog):
     @commands.slash_command(name="listevents", description="Lists current events")
     async def listevents(self, inter: disnake.ApplicationCommandInteraction):
         embed = disnake.Embed(color=0x00DDDD, title="Current Events")
-        data = await self.bot.db.fetchall("SELECT id, name FROM events")
+        data = await self.bot.db.fetchall(SELECT_EVENTS_SQL)
         for row in data:
             embed.add_field(name=row["name"], value=f"ID: {row['id'].hex}")
 
@@ -149,26 +149,24 @@ class EventManagement(Cog):
     )
     async def removeevent(self, inter: disnake.ApplicationCommandInteraction, id: str):
         id = uuid.UUID(id)
-        exists = await self.bot.db.fetchval("SELECT EXISTS(SELECT 1 FROM events WHERE id = $1)", id)
+        exists = await self.bot.db.fetchval(EVENT_EXISTS_SQL, id)
         if not exists:
             await inter.send("Event with this ID does not exist", ephemeral=True)
             return
         self.bot.log.info("%s started deletion of event %s", inter.author, id.hex)
         await inter.send("Removing roles...")
-        data = await self.bot.db.fetchall("SELECT role_id FROM groups WHERE event_id = $1", id)
+        data = await self.bot.db.fetchall(SELECT_GROUP_ROLES_SQL, id)
         for row in data:
             await inter.guild.get_role(row["role_id"]).delete()
 
         await inter.edit_original_response("Removing channel...")
-        channel = self.bot.get_channel(
-            await self.bot.db.fetchval("SELECT registration_channel_id FROM events WHERE id = $1", id)
-        )
+        channel = self.bot.get_channel(await self.bot.db.fetchval(SELECT_REGISTRATION_CHANNEL_SQL, id))
         if len(channel.category.channels) == 1:
             await channel.category.delete()
         await channel.delete()
 
         await inter.edit_original_response("Cleaning up database...")
-        await self.bot.db.execute("DELETE FROM events WHERE id = $1", id)
+        await self.bot.db.execute(REMOVE_EVENT_SQL, id)
 
         await inter.delete_original_response()
         await inter.send("Removed the event successfully!")
@@ -179,11 +177,11 @@ class EventManagement(Cog):
     )
     async def endevent(self, inter: disnake.ApplicationCommandInteraction, id: str):
         id = uuid.UUID(id)
-        exists = await self.bot.db.fetchval("SELECT EXISTS(SELECT 1 FROM events WHERE id = $1)", id)
+        exists = await self.bot.db.fetchval(EVENT_EXISTS_SQL, id)
         if not exists:
             await inter.send("Event with this ID does not exist", ephemeral=True)
             return
-        data = await self.bot.db.fetchall("SELECT role_id FROM groups WHERE event_id = $1", id)
+        data = await self.bot.db.fetchall(SELECT_GROUP_ROLES_SQL, id)
         roles = [inter.guild.get_role(i["role_id"]) for i in data]
         participants = set()
         for role in roles:
@@ -204,6 +202,7 @@ class TrophiesManagement(Cog):
     ):
         await inter.response.defer()
         await picture.save(Path("data/trophies/", id + ".png"))
+        trophy_thumbnails.drop(id)
         try:
             await self.bot.db.create_trophy(id, name)
             await inter.send("Successfully created a new trophy!")
@@ -217,6 +216,7 @@ class TrophiesManagement(Cog):
         id: str = commands.Param(max_length=32),
     ):
         await self.bot.db.remove_trophy(id)
+        trophy_thumbnails.drop(id)
         try:
             os.remove(Path("data/trophies/", id + ".png"))
         except FileNotFoundError:
@@ -1,48 +1,112 @@
-from typing import cast
+import asyncio
+from typing import Literal, cast
 
-import asyncpg
 import disnake
-from disnake.ext import commands, tasks
+from disnake.ext import commands
 
 from utils.bot import Cog
-from utils.constants import ENUMERATION_EMOJIS, POLLS_ROLE_ID
+from utils.cache import LRUCache
+from utils.constants import POLLS_ROLE_ID
 from utils.deco import emoji_enum
+from utils.edit_scheduler import EditScheduler
+from utils.poll_state import (
+    COUNT_ALL_VOTES_SQL,
+    COUNT_POLL_VOTES_SQL,
+    CREATE_POLL_SQL,
+    REMOVE_POLLS_SQL,
+    SELECT_POLLS_SQL,
+    VOTE_SQL,
+    PollState,
+    count_options,
+    poll_view,
+)
 from utils.views import ConfirmationView, Modal
 
 
 class Polls(Cog):
+    POLLS_CACHE_SIZE = 256
+
     def __init__(self, *args):
         super().__init__(*args)
-        self._requested_updates: dict[int, set[int]] = {}
-        self._messages: dict[int, disnake.Message] = {}
-        self.update_polls.start()
-
-    @tasks.loop(seconds=5)
-    async def update_polls(self):
-        for message_id in self._requested_updates.copy():
-            required_options = self._requested_updates[message_id]
-            if len(required_options) == 0:
-                continue
-            message = self._messages[message_id]
-            view = disnake.ui.View.from_message(message)
-            for item in view.children:
-                if not (isinstance(item, disnake.ui.Button) and item.custom_id.startswith("option-")):
-                    continue
-                if (option := int(item.custom_id.split("-")[1])) in required_options:
-                    votes: int = await self.bot.db.fetchval(
-                        "SELECT COUNT(*) FROM polls WHERE message_id = $1 AND option_id = $2",
-                        message_id,
-                        option,
-                    )
-                    item.label = f"{votes} vote{'' if votes == 1 else 's'}"
-            required_options.clear()
-            await message.edit(view=view)
-            view.stop()
+        # least recently voted polls are evicted and re-fetched from the database on their next vote
+        self._polls: LRUCache[int, PollState] = LRUCache(self.POLLS_CACHE_SIZE)
+        self._poll_ids: set[int] = set()  # messages listed in polls_messages
+        self._polls_loaded = asyncio.Event()
+        self._edits = EditScheduler(self.update_poll)
+        # (message ID, member ID) -> [lock, users of the lock], see polls_listener
+        self._vote_locks: dict[tuple[int, int], list] = {}
+        # a poll missing from the cache is fetched once, votes don't start their upsert while it is fetched
+        # and the fetch waits for the upserts in flight, so it counts exactly the votes stored before it
+        self._fetches: dict[int, asyncio.Task[PollState]] = {}
+        self._upserts: dict[int, int] = {}  # message ID -> upserts in flight
+        self._gate = asyncio.Condition()
+
+    async def cog_load(self):
+        await self.bot.wait_until_ready()
+        data = await self.bot.db.fetchall(SELECT_POLLS_SQL, background=True)
+        self._poll_ids = {row["message_id"] for row in data}
+        data = await self.bot.db.fetchall(COUNT_ALL_VOTES_SQL, background=True)
+        polls: dict[int, PollState] = {}
+        for row in data:
+            if (state := polls.get(row["message_id"])) is None:
+                state = polls[row["message_id"]] = PollState(row["message_id"])
+            state.tallies[row["option_id"] - 1] = row["votes"]
+        # message IDs are snowflakes, so the biggest ones belong to the newest polls
+        for message_id in sorted(polls)[-self.POLLS_CACHE_SIZE :]:
+            self._polls.set(message_id, polls[message_id])
+        self._polls_loaded.set()
+        self.bot.log.info("Loaded %d polls, cached vote tallies of %d", len(self._poll_ids), len(self._polls))
+
+    async def _fetch_poll(self, message: disnake.Message) -> PollState:
+        """Use through ``_fetches``, only one fetch of a poll may run at a time."""
+        try:
+            async with self._gate:
+                await self._gate.wait_for(lambda: not self._upserts.get(message.id))
+            state = PollState(message.id, message.channel.id, count_options(message))
+            data = await self.bot.db.fetchall(COUNT_POLL_VOTES_SQL, message.id)
+            for row in data:
+                state.tallies[row["option_id"] - 1] = row["votes"]
+            self._polls.set(message.id, state)
+            return state
+        finally:
+            async with self._gate:
+                del self._fetches[message.id]
+                self._gate.notify_all()
+
+    def _end_upsert(self, message_id: int):
+        self._upserts[message_id] -= 1
+        if not self._upserts[message_id]:
+            del self._upserts[message_id]
+            self._gate.notify_all()
+
+    async def _remove_polls(self, message_ids: list[int]):
+        for message_id in message_ids:
+            self._poll_ids.discard(message_id)
+            self._polls.invalidate(message_id)
+            self._edits.cancel(message_id)
+        await self.bot.db.execute(REMOVE_POLLS_SQL, message_ids)
+
+    async def update_poll(self, message_id: int):
+        if (state := self._polls.get(message_id)) is None:
+            return  # the poll was ended or deleted in the meantime
+        channel = self.bot.get_channel(state.channel_id)
+        if channel is None:
+            return
+        view = state.view()
+        await channel.get_partial_message(message_id).edit(view=view)
+        view.stop()
 
     @Cog.listener(disnake.Event.raw_message_delete)
     async def polls_cleanup(self, payload: disnake.RawMessageDeleteEvent):
-        await self.bot.db.execute("DELETE FROM polls WHERE message_id = $1", payload.message_id)
-        await self.bot.db.execute("DELETE FROM polls_messages WHERE message_id = $1", payload.message_id)
+        await self._polls_loaded.wait()
+        if payload.message_id in self._poll_ids:
+            await self._remove_polls([payload.message_id])
+
+    @Cog.listener(disnake.Event.raw_bulk_message_delete)
+    async def polls_bulk_cleanup(self, payload: disnake.RawBulkMessageDeleteEvent):
+        await self._polls_loaded.wait()
+        if message_ids := list(payload.message_ids & self._poll_ids):
+            await self._remove_polls(message_ids)
 
     @Cog.listener(disnake.Event.button_click)
     async def polls_listener(self, inter: disnake.MessageInteraction):
@@ -52,41 +116,55 @@ class Polls(Cog):
         option_id = int(button.custom_id.split("-")[1])
         message_id = inter.message.id
         user_id = inter.author.id
+        await self._polls_loaded.wait()
 
-        self._messages[message_id] = inter.message
-
+        # the upsert reports the previous vote from the statement snapshot, two concurrent clicks of
+        # one member would both see no previous vote, so they are serialized to keep the tallies right
+        key = (message_id, user_id)
+        entry = self._vote_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
         try:
-            await self.bot.db.execute(
-                "INSERT INTO polls (message_id, option_id, member_id) VALUES ($1, $2, $3)",
-                message_id,
-                option_id,
-                user_id,
-            )
-            await inter.send("Registered your vote!", ephemeral=True)
-        except asyncpg.UniqueViolationError:
-            old_option: int = await self.bot.db.fetchval(
-                "SELECT option_id FROM polls WHERE member_id = $1 AND message_id = $2",
-                user_id,
-                message_id,
-            )
-            if old_option == option_id:
-                await inter.send("You already voted for this option!", ephemeral=True)
-                return
-            await self.bot.db.execute(
-                "UPDATE polls SET option_id = $1 WHERE member_id = $2 AND message_id = $3",
-                option_id,
-                user_id,
-                message_id,
-            )
-            await inter.send("Overwrote your vote!", ephemeral=True)
-            self._request_update(message_id, old_option)
+            async with entry[0]:
+                old_option = await self._vote(inter, option_id)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._vote_locks[key]
+        if old_option is False:
+            await inter.send("You already voted for this option!", ephemeral=True)
+            return
+        self._edits.request(message_id, inter.channel.id)
+        await inter.send("Registered your vote!" if old_option is None else "Overwrote your vote!", ephemeral=True)
 
-        self._request_update(message_id, option_id)
+    async def _vote(self, inter: disnake.MessageInteraction, option_id: int) -> int | None | Literal[False]:
+        """:return: The option voted for before, ``None`` for a new vote, ``False`` if the vote didn't change."""
+        message_id = inter.message.id
+        async with self._gate:
+            await self._gate.wait_for(lambda: message_id not in self._fetches)
+            self._upserts[message_id] = self._upserts.get(message_id, 0) + 1
+        try:
+            row = await self.bot.db.fetchrow(VOTE_SQL, message_id, option_id, inter.author.id)
+        except BaseException:
+            async with self._gate:
+                self._end_upsert(message_id)
+            raise
 
-    def _request_update(self, message_id: int, option_id: int):
-        if message_id not in self._requested_updates:
-            self._requested_updates[message_id] = set()
-        self._requested_updates[message_id].add(option_id)
+        async with self._gate:
+            self._end_upsert(message_id)
+            if row is None:
+                return False
+            if (state := self._polls.get(message_id)) is None:
+                # the fetch has not queried yet, as this upsert was in flight until now, so it counts this vote
+                if (fetch := self._fetches.get(message_id)) is None:
+                    fetch = self._fetches[message_id] = asyncio.create_task(self._fetch_poll(inter.message))
+            else:
+                state.vote(option_id, row["old_option"])
+                if not state.options:
+                    state.channel_id = inter.channel.id
+                    state.options = count_options(inter.message)
+        if state is None:
+            await asyncio.shield(fetch)
+        return row["old_option"]
 
     @commands.slash_command(name="poll")
     @commands.default_member_permissions(manage_messages=True)
@@ -143,16 +221,7 @@ class Polls(Cog):
         await inter.message.edit(view=view)
         await inter.response.defer()
 
-        view = disnake.ui.View()
-        for i, (e, _) in enumerate(zip(ENUMERATION_EMOJIS, options), 1):
-            view.add_item(
-                disnake.ui.Button(
-                    style=disnake.ButtonStyle.blurple,
-                    label="0 votes",
-                    emoji=e,
-                    custom_id=f"option-{i}",
-                )
-            )
+        view = poll_view([0] * len(options))
         m = await channel.send(
             f"<@&{POLLS_ROLE_ID}> new poll!",
             embed=embed,
@@ -161,26 +230,20 @@ class Polls(Cog):
         )
         view.stop()
         await inter.send("Successfully sent the new poll!")
-        await self.bot.db.execute("INSERT INTO polls_messages (message_id) VALUES ($1)", m.id)
+        self._poll_ids.add(m.id)
+        await self.bot.db.execute(CREATE_POLL_SQL, m.id)
 
     @commands.message_command(name="End Poll")
     @commands.default_member_permissions(manage_messages=True)
     async def end_poll(self, inter: disnake.MessageInteraction, msg: disnake.Message):
-        if msg.author != inter.guild.me or not await self.bot.db.fetchval(
-            "SELECT EXISTS(SELECT * FROM polls_messages WHERE message_id = $1)", msg.id
-        ):
+        await self._polls_loaded.wait()
+        if msg.author != inter.guild.me or msg.id not in self._poll_ids:
             await inter.send("This message is not a poll!")
             return
         await inter.response.defer(ephemeral=True)
-        try:
-            self._requested_updates.get(msg.channel.id, set()).remove(msg.id)
-        except KeyError:
-            pass
-        self._messages.pop(msg.id, None)
+        await self._remove_polls([msg.id])
         view = disnake.ui.View.from_message(msg)
         for item in view.children:
             item.disabled = True
         await msg.edit(view=view)
-        await self.bot.db.execute("DELETE FROM polls WHERE message_id = $1", msg.id)
-        await self.bot.db.execute("DELETE FROM polls_messages WHERE message_id = $1", msg.id)
         await inter.send("Ended this poll!", ephemeral=True)
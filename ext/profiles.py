@@ -1,20 +1,42 @@
+import asyncio
+import os
+from datetime import timedelta
+
 import asyncpg
 import disnake
-from disnake.ext import commands
+from disnake.ext import commands, tasks
 
+from utils.avatars import AvatarCache
 from utils.bot import Cog
-from utils.image_generation import draw_profile_card
+from utils.image_generation import PROF_OUTPUT, draw_profile_card
+from utils.renderer import RendererBusy
 
 
 class EventProfile(Cog):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.avatars = AvatarCache(timedelta(days=int(os.getenv("AVATAR_MAX_AGE_DAYS", 30))))
+        self.prune_avatars.start()
+
+    def cog_unload(self):
+        self.prune_avatars.cancel()
+
+    @tasks.loop(hours=24)
+    async def prune_avatars(self):
+        await self.avatars.prune()
+
     @commands.cooldown(1, 15, commands.BucketType.user)
     @commands.slash_command(name="profile", description="Display your or other user's event profile")
     async def profile(self, inter: disnake.ApplicationCommandInteraction, user: disnake.Member = None):
         await inter.response.defer()
         user = user or inter.author
-        event_user = await self.bot.db.get_event_user(user.id).load()
-        pic = await draw_profile_card(user, event_user)
-        await inter.send(file=disnake.File(pic, "profile.png"))
+        event_user, avatar = await asyncio.gather(self.bot.db.load_event_user(user.id), self.avatars.get(user))
+        try:
+            pic = await draw_profile_card(str(user), avatar, user.display_avatar.key, event_user)
+        except RendererBusy:
+            await inter.send("Too many images are being generated right now, please try again in a few seconds")
+            return
+        await inter.send(file=disnake.File(pic, PROF_OUTPUT.filename("profile")))
 
 
 class ProfileAdministration(Cog):
@@ -1,5 +1,9 @@
+import asyncio
+import os
+from datetime import timedelta, timezone
 from io import BytesIO
 
+import asyncpg
 import disnake
 import pendulum
 from disnake.ext import commands, tasks
@@ -7,29 +11,124 @@ from pendulum.parsing import ParserError
 
 from utils.bot import Bot, Cog
 from utils.constants import SERVER_ID
-from utils.image_generation import draw_activity_plot, draw_statistics_card
-from utils.tracking import Session
+from utils.deco import fduration, fnum
+from utils.image_generation import (
+    ACTIVITY_OUTPUT,
+    ACTIVITY_PLOT_POINTS,
+    STATS_OUTPUT,
+    draw_activity_plot,
+    draw_statistics_card,
+)
+from utils.renderer import RendererBusy
+from utils.stats_rollups import DELETE_OLD_STATS_SQL, RECORD_STATS_SQL, pick_rollup
+from utils.tracking import (
+    CHECKPOINT_SQL,
+    CREATE_SESSION_SQL,
+    REMOVE_SESSION_SQL,
+    SELECT_SESSION_MINUTES_SQL,
+    SELECT_SESSION_USERS_SQL,
+    SELECT_SESSIONS_SQL,
+    Session,
+)
 
 
 class Tracking(Cog):
     def __init__(self, bot: Bot):
         super().__init__(bot)
         self.sessions: dict[int, Session] = {}
+        # keeps a checkpoint from writing rows of a session that is being started or stopped
+        self._checkpoint_lock = asyncio.Lock()
+        self.checkpoint.change_interval(seconds=int(os.getenv("TRACKING_CHECKPOINT_INTERVAL", 30)))
 
-    def new_session(self, channel: disnake.TextChannel):
-        self.sessions[channel.id] = Session(channel)
+    async def cog_load(self):
+        await self.bot.wait_until_ready()
+        try:
+            await self._restore_sessions()
+        finally:
+            # sessions started after a failed restore still need their checkpoints
+            self.checkpoint.start()
+
+    async def _restore_sessions(self):
+        users: dict[int, dict[int, int]] = {}
+        minutes: dict[int, dict[int, int]] = {}
+        for row in await self.bot.db.fetchall(SELECT_SESSION_USERS_SQL, background=True):
+            users.setdefault(row["channel_id"], {})[row["user_id"]] = row["messages"]
+        for row in await self.bot.db.fetchall(SELECT_SESSION_MINUTES_SQL, background=True):
+            minutes.setdefault(row["channel_id"], {})[row["minute"]] = row["messages"]
+
+        for row in await self.bot.db.fetchall(SELECT_SESSIONS_SQL, background=True):
+            channel = self.bot.get_channel(row["channel_id"])
+            if not isinstance(channel, disnake.TextChannel):
+                self.bot.log.warning("Dropping tracking session of unknown channel %d", row["channel_id"])
+                await self.bot.db.execute(REMOVE_SESSION_SQL, row["channel_id"], background=True)
+                continue
+            session = Session(channel, pendulum.instance(row["started_at"].replace(tzinfo=timezone.utc)))
+            session.restore(users.get(channel.id, {}), minutes.get(channel.id, {}))
+            self.sessions[channel.id] = session
+        self.bot.log.info("Restored %d tracking sessions", len(self.sessions))
+
+    def cog_unload(self):
+        self.checkpoint.cancel()
+
+    async def shutdown(self):
+        # lets a checkpoint in progress finish, cancelling it could lose the changes it took
+        self.checkpoint.stop()
+        await self.checkpoint()
+
+    @tasks.loop(seconds=30)
+    async def checkpoint(self):
+        async with self._checkpoint_lock:
+            changes = {channel_id: session.take_changes() for channel_id, session in self.sessions.items()}
+            users = [(channel_id, *e) for channel_id, (u, _) in changes.items() for e in u.items()]
+            minutes = [(channel_id, *e) for channel_id, (_, m) in changes.items() for e in m.items()]
+            if not users and not minutes:
+                return
+            try:
+                # rows to columns, for the unnest calls
+                columns = (list(zip(*users)) or [()] * 3) + (list(zip(*minutes)) or [()] * 3)
+                await self.bot.db.execute(CHECKPOINT_SQL, *columns, background=True)
+            except (asyncpg.IntegrityConstraintViolationError, asyncpg.DataError):
+                # the data itself was rejected, retrying would fail forever
+                self.bot.log.exception("Failed to checkpoint tracking sessions, the changes were dropped")
+            except (OSError, asyncpg.InterfaceError, asyncpg.PostgresError):
+                # connection losses, restarts, deadlocks and the like, the write can succeed later
+                self.bot.log.exception("Failed to checkpoint tracking sessions, will retry")
+                self._return_changes(changes)
+            except BaseException:
+                self._return_changes(changes)
+                raise
+
+    def _return_changes(self, changes: dict[int, tuple[dict[int, int], dict[int, int]]]):
+        for channel_id, (users, minutes) in changes.items():
+            if (session := self.sessions.get(channel_id)) is not None:
+                session.return_changes(users, minutes)
+
+    async def new_session(self, channel: disnake.TextChannel):
+        session = Session(channel)
+        async with self._checkpoint_lock:
+            await self.bot.db.execute(REMOVE_SESSION_SQL, channel.id)
+            await self.bot.db.execute(
+                CREATE_SESSION_SQL,
+                channel.id,
+                session.started_at.in_timezone("UTC").naive(),
+            )
+            self.sessions[channel.id] = session
 
     async def end_session(self, channel: disnake.TextChannel) -> BytesIO:
-        session = self.sessions.pop(channel.id)
-        session.log.info("Activity tracking finished")
-        delta = pendulum.now() - session.started_at
-        return await draw_statistics_card(
+        """:raise RendererBusy: The session is kept running, so it can be stopped again later."""
+        session = self.sessions[channel.id]
+        pic = await draw_statistics_card(
             channel.name,
-            f"{delta.hours}:{delta.minutes}:{delta.seconds}",
+            fduration(session.duration),
             session.total_messages,
             session.total_participants,
             list(map(lambda e: str(channel.guild.get_member(e)), session.get_top_users(5))),
         )
+        async with self._checkpoint_lock:
+            if self.sessions.pop(channel.id, None) is not None:
+                session.log.info("Activity tracking finished")
+                await self.bot.db.execute(REMOVE_SESSION_SQL, channel.id)
+        return pic
 
     @Cog.listener()
     async def on_message(self, msg: disnake.Message):
@@ -45,9 +144,38 @@ class Tracking(Cog):
         channel: disnake.TextChannel = None,
     ):
         channel = channel or inter.channel
-        self.new_session(channel)
+        await self.new_session(channel)
         await inter.send(f"Started activity tracking in {channel.mention}")
 
+    @commands.slash_command(name="trackstatus", description="Shows live stats of activity tracking in selected channel")
+    async def trackstatus(
+        self,
+        inter: disnake.ApplicationCommandInteraction,
+        channel: disnake.TextChannel = None,
+    ):
+        channel = channel or inter.channel
+        if (session := self.sessions.get(channel.id)) is None:
+            await inter.send(f"There's no activity tracking session in {channel.mention}")
+            return
+        embed = disnake.Embed(color=0x00DDDD, title=f"Tracking #{channel.name}")
+        embed.add_field(name="Duration", value=fduration(session.duration))
+        embed.add_field(name="Messages", value=fnum(session.total_messages))
+        embed.add_field(name="Participants", value=fnum(session.total_participants))
+        embed.add_field(
+            name="Messages per minute",
+            value=f"{session.timeline.rate():.1f} in last 5 minutes, "
+            f"{session.total_messages / max(session.duration / 60, 1):.1f} overall",
+            inline=False,
+        )
+        top = session.users.top(10)
+        embed.add_field(
+            name="Top participants",
+            value="\n".join(f"#{i}. <@{user_id}> - {fnum(count)}" for i, (user_id, count) in enumerate(top, 1))
+            or "Nobody has sent a message yet",
+            inline=False,
+        )
+        await inter.send(embed=embed)
+
     @commands.slash_command(name="stoptrack", description="Stops activity tracking in selected channel")
     async def stoptrack(
         self,
@@ -59,14 +187,21 @@ class Tracking(Cog):
             await inter.send(f"There's no activity tracking session in {channel.mention}")
             return
         await inter.response.defer()
-        pic = await self.end_session(channel)
-        await inter.send(file=disnake.File(pic, "stats.png"))
+        try:
+            pic = await self.end_session(channel)
+        except RendererBusy:
+            await inter.send("Too many images are being generated right now, tracking continues until you try again")
+            return
+        await inter.send(file=disnake.File(pic, STATS_OUTPUT.filename("stats")))
 
 
 class ActivityTracking(Cog):
     def __init__(self, *args):
         super().__init__(*args)
+        # raw samples are only kept for a while, /stats reads the rollups which are kept forever
+        self.retention = timedelta(days=int(os.getenv("STATS_RETENTION_DAYS", 90)))
         self.activity_track.start()
+        self.stats_retention.start()
 
     @tasks.loop(hours=1)
     async def activity_track(self):
@@ -78,7 +213,12 @@ class ActivityTracking(Cog):
             if m.status != disnake.Status.offline:
                 data[d[m.status]] += 1
 
-        await self.bot.db.execute("INSERT INTO stats (online, idle, dnd) VALUES ($1, $2, $3)", *data)
+        await self.bot.db.execute(RECORD_STATS_SQL, *data, background=True)
+
+    @tasks.loop(hours=24)
+    async def stats_retention(self):
+        await self.bot.wait_until_ready()
+        await self.bot.db.execute(DELETE_OLD_STATS_SQL, self.retention, background=True)
 
     @commands.slash_command(name="stats", description="Display stats for the specified period")
     async def stats(
@@ -90,21 +230,20 @@ class ActivityTracking(Cog):
         try:
             start = pendulum.parse(period_start, strict=False, tz=None)
             end = pendulum.parse(period_end, strict=False, tz=None)
-            if not 2 <= (end - start).total_hours() <= 154:
-                await inter.send(
-                    "The duration must be more than 2 hours and less than 7 days",
-                    ephemeral=True,
-                )
+            if (end - start).total_hours() < 2:
+                await inter.send("The duration must be at least 2 hours", ephemeral=True)
                 return
         except ParserError:
             await inter.send("Invalid time provided", ephemeral=True)
             return
 
         await inter.response.defer()
-        data = await self.bot.db.fetchall(
-            "SELECT time, online, idle, dnd FROM stats WHERE time BETWEEN $1 AND $2 ORDER BY time",
-            start,
-            end,
-        )
-        pic = await draw_activity_plot(data)
-        await inter.send(file=disnake.File(pic, "stats.png"))
+        # one row of arrays instead of a row per bucket, they are turned into NumPy arrays without per-row work
+        rollup = pick_rollup(start, end, ACTIVITY_PLOT_POINTS)
+        data = await self.bot.db.fetchrow(rollup.select_sql, rollup.truncate(start), end)
+        try:
+            pic = await draw_activity_plot(*(data[column] or [] for column in ("time", "online", "idle", "dnd")))
+        except RendererBusy:
+            await inter.send("Too many images are being generated right now, please try again in a few seconds")
+            return
+        await inter.send(file=disnake.File(pic, ACTIVITY_OUTPUT.filename("stats")))
@@ -1,3 +1,4 @@
 from utils.bot import Bot
 
-Bot().run()
+if __name__ == "__main__":  # render worker processes import this module too
+    Bot().run()
@@ -0,0 +1,3 @@
+-- no transaction
+DROP INDEX CONCURRENTLY IF EXISTS polls_message_option_idx;
+CREATE INDEX CONCURRENTLY polls_message_option_idx ON polls (message_id, option_id);
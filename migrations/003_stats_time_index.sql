@@ -0,0 +1,3 @@
+-- no transaction
+DROP INDEX CONCURRENTLY IF EXISTS stats_time_idx;
+CREATE INDEX CONCURRENTLY stats_time_idx ON stats (time);
@@ -0,0 +1,3 @@
+-- no transaction
+DROP INDEX CONCURRENTLY IF EXISTS groups_open_start_time_idx;
+CREATE INDEX CONCURRENTLY groups_open_start_time_idx ON groups (start_time) WHERE NOT closed;
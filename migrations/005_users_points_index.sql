@@ -0,0 +1,3 @@
+-- no transaction
+DROP INDEX CONCURRENTLY IF EXISTS users_points_idx;
+CREATE INDEX CONCURRENTLY users_points_idx ON users (points);
@@ -0,0 +1,43 @@
+CREATE TABLE IF NOT EXISTS stats_hourly
+(
+    bucket     TIMESTAMP PRIMARY KEY,
+    samples    INT    NOT NULL,
+    online_min INT    NOT NULL,
+    online_max INT    NOT NULL,
+    online_sum BIGINT NOT NULL,
+    idle_min   INT    NOT NULL,
+    idle_max   INT    NOT NULL,
+    idle_sum   BIGINT NOT NULL,
+    dnd_min    INT    NOT NULL,
+    dnd_max    INT    NOT NULL,
+    dnd_sum    BIGINT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS stats_daily (LIKE stats_hourly INCLUDING ALL);
+
+CREATE TABLE IF NOT EXISTS stats_weekly (LIKE stats_hourly INCLUDING ALL);
+
+INSERT INTO stats_hourly
+SELECT date_trunc('hour', time), COUNT(*),
+       MIN(online), MAX(online), SUM(online),
+       MIN(idle), MAX(idle), SUM(idle),
+       MIN(dnd), MAX(dnd), SUM(dnd)
+FROM stats
+WHERE time IS NOT NULL
+GROUP BY 1;
+
+INSERT INTO stats_daily
+SELECT date_trunc('day', bucket), SUM(samples),
+       MIN(online_min), MAX(online_max), SUM(online_sum),
+       MIN(idle_min), MAX(idle_max), SUM(idle_sum),
+       MIN(dnd_min), MAX(dnd_max), SUM(dnd_sum)
+FROM stats_hourly
+GROUP BY 1;
+
+INSERT INTO stats_weekly
+SELECT date_trunc('week', bucket), SUM(samples),
+       MIN(online_min), MAX(online_max), SUM(online_sum),
+       MIN(idle_min), MAX(idle_max), SUM(idle_sum),
+       MIN(dnd_min), MAX(dnd_max), SUM(dnd_sum)
+FROM stats_daily
+GROUP BY 1;
@@ -0,0 +1,21 @@
+CREATE TABLE IF NOT EXISTS tracking_sessions
+(
+    channel_id BIGINT PRIMARY KEY,
+    started_at TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS tracking_users
+(
+    channel_id BIGINT NOT NULL REFERENCES tracking_sessions ON DELETE CASCADE,
+    user_id    BIGINT NOT NULL,
+    messages   INT    NOT NULL,
+    PRIMARY KEY (channel_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS tracking_minutes
+(
+    channel_id BIGINT NOT NULL REFERENCES tracking_sessions ON DELETE CASCADE,
+    minute     INT    NOT NULL,
+    messages   INT    NOT NULL,
+    PRIMARY KEY (channel_id, minute)
+);
@@ -0,0 +1,95 @@
+import asyncio
+import os
+import time
+from datetime import timedelta
+from io import BytesIO
+from pathlib import Path
+
+import disnake
+from PIL import Image, ImageDraw, ImageOps
+
+from utils.cache import LRUCache
+from utils.logs import Logger
+
+AVATAR_SIZE = (316, 316)
+
+AVATAR_MASK = Image.new("L", AVATAR_SIZE)
+ImageDraw.Draw(AVATAR_MASK).ellipse((0, 0) + AVATAR_SIZE, fill="#fff")
+
+
+def _prepare_avatar(data: bytes, path: Path) -> Image.Image:
+    with Image.open(BytesIO(data)) as img:
+        avatar = ImageOps.fit(img.convert("RGBA"), AVATAR_SIZE, Image.LANCZOS)
+    avatar.putalpha(AVATAR_MASK)
+    avatar.save(path, format="png")
+    return avatar
+
+
+def _load_avatar(path: Path) -> Image.Image | None:
+    try:
+        with Image.open(path) as img:
+            img.load()
+        os.utime(path)  # the mtime tells when the avatar was last used, see _prune_avatars
+        return img
+    except (OSError, ValueError):
+        return None
+
+
+def _prune_avatars(path: Path, max_age: float) -> int:
+    """Removes the avatars not used for ``max_age`` seconds, returns how many were removed."""
+    cutoff = time.time() - max_age
+    removed = 0
+    for file in path.glob("*.png"):
+        try:
+            if file.stat().st_mtime < cutoff:
+                file.unlink()
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+class AvatarCache:
+    """
+    Avatars resized to ``AVATAR_SIZE`` and cut to a circle, ready to be pasted with themselves as the mask.
+
+    Images are keyed by avatar hash, so a changed avatar gets a new key, and kept in memory
+    and in ``data/avatars``, thus an unchanged avatar is downloaded only once.
+    Files not used for ``max_age`` are removed by ``prune``.
+    """
+
+    PATH = Path("data/avatars")
+    MEMORY_SIZE = 128
+
+    def __init__(self, max_age: timedelta):
+        self.max_age = max_age
+        self._memory: LRUCache[str, Image.Image] = LRUCache(self.MEMORY_SIZE)
+        self._pending: dict[str, asyncio.Task[Image.Image]] = {}
+        self._log = Logger("AVATARS")
+
+    async def get(self, user: disnake.User | disnake.Member) -> Image.Image:
+        asset = user.display_avatar
+        if (avatar := self._memory.get(asset.key)) is not None:
+            return avatar
+        # concurrent requests of the same avatar share the download
+        if (task := self._pending.get(asset.key)) is None:
+            task = self._pending[asset.key] = asyncio.create_task(self._fetch(asset))
+            task.add_done_callback(lambda _: self._pending.pop(asset.key, None))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, asset: disnake.Asset) -> Image.Image:
+        loop = asyncio.get_event_loop()
+        path = self.PATH / f"{asset.key}.png"
+        avatar = await loop.run_in_executor(None, _load_avatar, path)
+        if avatar is None:
+            # goes through the bot's HTTP session, animated avatars are served as their first frame
+            data = await asset.with_static_format("png").with_size(512).read()
+            avatar = await loop.run_in_executor(None, _prepare_avatar, data, path)
+            self._log.debug("Downloaded avatar %s", asset.key)
+        self._memory.set(asset.key, avatar)
+        return avatar
+
+    async def prune(self):
+        loop = asyncio.get_event_loop()
+        removed = await loop.run_in_executor(None, _prune_avatars, self.PATH, self.max_age.total_seconds())
+        self._log.info("Removed %d avatars unused for %d days", removed, self.max_age.days)
@@ -7,9 +7,11 @@ import disnake
 from disnake.ext import commands
 
 from utils.database import Database
+from utils.image_generation import renderer
 from utils.logs import Logger
+from utils.memory_database import MemoryDatabase
 
-REQUIRED_DIRS = ["data", "data/trophies", "data/logs"]
+REQUIRED_DIRS = ["data", "data/trophies", "data/logs", "data/avatars"]
 for d in REQUIRED_DIRS:
     if not os.path.exists(d):
         os.mkdir(d)
@@ -27,7 +29,8 @@ class Bot(commands.InteractionBot):
             message_content=True,
             presences=True,
         )
-        self.db = Database()
+        # the in-memory backend is meant for load testing, all data is lost on shutdown
+        self.db = MemoryDatabase() if os.getenv("DATABASE_BACKEND") == "memory" else Database()
         self.log = Logger()
         self.server: disnake.Guild | None = None
 
@@ -60,7 +63,11 @@ class Bot(commands.InteractionBot):
 
     async def close(self) -> None:
         self.log.info("Shutting down...")
+        for cog in self.cogs.values():
+            if isinstance(cog, Cog):
+                await cog.shutdown()
         await self.db.close()
+        renderer.close()
         self.log.ok("Bot was shut down successfully")
 
     def auto_setup(self, module_name: str):
@@ -92,3 +99,6 @@ class Bot(commands.InteractionBot):
 class Cog(commands.Cog):
     def __init__(self, bot: Bot):
         self.bot = bot
+
+    async def shutdown(self):
+        """Called when the bot is closing, before the database connection is closed."""
@@ -0,0 +1,84 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Iterable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """
+    Bounded least-recently-used cache with optional time-to-live.
+
+    ``generation`` is bumped on every invalidation, readers that load a value
+    concurrently with a write pass the generation they started at to ``set``,
+    so a stale value is never stored.
+
+    With ``sizeof``, ``maxsize`` caps the total size of the values, e.g. in bytes, instead of their count.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None, sizeof: Callable[[V], int] | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._data: OrderedDict[K, tuple[float, V, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} size={self.size}/{self.maxsize} hits={self.hits} misses={self.misses}>"
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key: K) -> V | None:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value, _ = entry
+        if self.ttl is not None and expires_at < time.monotonic():
+            self._pop(key)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: K, value: V, generation: int | None = None):
+        if generation is not None and generation != self.generation:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else 0
+        size = self.sizeof(value) if self.sizeof is not None else 1
+        self._pop(key)
+        if size > self.maxsize:
+            return  # would evict everything else and itself
+        self._data[key] = (expires_at, value, size)
+        self.size += size
+        while self.size > self.maxsize:
+            self.size -= self._data.popitem(last=False)[1][2]
+
+    def invalidate(self, key: K):
+        self.generation += 1
+        self._pop(key)
+
+    def invalidate_many(self, keys: Iterable[K]):
+        self.generation += 1
+        for key in keys:
+            self._pop(key)
+
+    def clear(self):
+        self.generation += 1
+        self._data.clear()
+        self.size = 0
+
+    def _pop(self, key: K):
+        if (entry := self._data.pop(key, None)) is not None:
+            self.size -= entry[2]
@@ -1,43 +1,135 @@
 import os
 import sys
 import uuid
-from typing import Any, Self
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterable, Self
 
 import asyncpg
 from disnake import Message
 
+from utils.cache import LRUCache
 from utils.logs import Logger
+from utils.points_buffer import PointsBuffer
+from utils.pool import Pool, PoolStats
+from utils.ranking import RankIndex
+
+# statements also implemented by MemoryDatabase, which registers them by these constants
+SELECT_POINTS_SQL = "SELECT id, points FROM users"
+UPDATE_POINTS_SQL = "UPDATE users SET points = points + $2 WHERE id = $1 RETURNING points"
+ADD_POINTS_BULK_SQL = (
+    "INSERT INTO users (id, points) SELECT unnest($1::BIGINT[]), $2 "
+    "ON CONFLICT (id) DO UPDATE SET points = users.points + EXCLUDED.points "
+    "RETURNING id, points"
+)
+REGISTER_EVENT_RESULTS_SQL = (
+    "INSERT INTO users (id, total_events, won_events) "
+    "SELECT id, (id = ANY($1::BIGINT[]))::INT, (id = ANY($2::BIGINT[]))::INT "
+    "FROM (SELECT DISTINCT unnest($1::BIGINT[] || $2::BIGINT[]) AS id) AS ids "
+    "ON CONFLICT (id) DO UPDATE SET total_events = users.total_events + EXCLUDED.total_events, "
+    "won_events = users.won_events + EXCLUDED.won_events"
+)
+CREATE_TROPHY_SQL = "INSERT INTO trophies (id, name) VALUES ($1, $2)"
+REMOVE_TROPHY_SQL = "DELETE FROM trophies WHERE id = $1"
+GIVE_TROPHY_SQL = "INSERT INTO inventories (id, trophy_id) VALUES ($1, $2)"
+GIVE_TROPHY_BULK_SQL = (
+    # inventory rows are checked against users at the end of the statement, after the CTE has inserted them
+    "WITH ensured AS (INSERT INTO users (id) SELECT unnest($1::BIGINT[]) ON CONFLICT DO NOTHING) "
+    "INSERT INTO inventories (id, trophy_id) SELECT unnest($1::BIGINT[]), $2 ON CONFLICT DO NOTHING"
+)
+TAKE_TROPHY_SQL = "DELETE FROM inventories WHERE id = $1 AND trophy_id = $2"
+CREATE_EVENT_SQL = (
+    "INSERT INTO events (id, name, registration_channel_id, registration_message_id) VALUES ($1, $2, $3, $4)"
+)
+CREATE_GROUP_SQL = "INSERT INTO groups (event_id, start_time, role_id) VALUES ($1, $2, $3)"
+CREATE_GROUPS_SQL = (
+    "INSERT INTO groups (event_id, role_id, start_time) "
+    "SELECT * FROM unnest($1::UUID[], $2::BIGINT[], $3::TIMESTAMP[])"
+)
+SELECT_EVENTS_SQL = "SELECT id, name FROM events"
+EVENT_EXISTS_SQL = "SELECT EXISTS(SELECT 1 FROM events WHERE id = $1)"
+SELECT_REGISTRATION_SQL = (
+    "SELECT registration_channel_id AS channel_id, registration_message_id AS message_id FROM events WHERE id = $1"
+)
+SELECT_REGISTRATION_CHANNEL_SQL = "SELECT registration_channel_id FROM events WHERE id = $1"
+REMOVE_EVENT_SQL = "DELETE FROM events WHERE id = $1"
+SELECT_GROUP_ROLES_SQL = "SELECT role_id FROM groups WHERE event_id = $1"
+SELECT_GROUPS_TO_CLOSE_SQL = "SELECT role_id, event_id FROM groups WHERE start_time < $1 AND closed = FALSE"
+CLOSE_GROUPS_SQL = "UPDATE groups SET closed = TRUE WHERE start_time < $1 AND closed = FALSE"
+TROPHY_EXISTS_SQL = "SELECT EXISTS(SELECT 1 FROM trophies WHERE id = $1)"
 
 
 class Database:
-    VERSION = 1
+    MIGRATIONS_PATH = Path("migrations")
+    NO_TRANSACTION_MARK = "-- no transaction"
+    USER_CACHE_SIZE = 512
+    USER_CACHE_TTL = 300
 
     def __init__(self):
-        self._pool: asyncpg.Pool | None = None
+        self._pool: Pool | None = None  # interactive queries, i.e. commands and components
+        self._background_pool: Pool | None = None  # loops and mass writes
         self._log: Logger = Logger("DB")
+        self.ranks = RankIndex()
+        self.users_cache: LRUCache[int, EventUser] = LRUCache(self.USER_CACHE_SIZE, self.USER_CACHE_TTL)
+        self.points_buffer: PointsBuffer | None = None
+        if interval := os.getenv("POINTS_FLUSH_INTERVAL"):  # milliseconds, write-behind is disabled if unset
+            self.points_buffer = PointsBuffer(self, int(interval) / 1000, int(os.getenv("POINTS_FLUSH_THRESHOLD", 100)))
 
     async def connect(self):
         self._log.info("Connecting to database...")
         try:
-            self._pool = await asyncpg.create_pool(
+            connect_kwargs = dict(
                 database=os.environ["DATABASE"],
                 user=os.environ["USER"],
                 password=os.getenv("PASSWORD", None),
-                host="127.0.0.1",
+                host=os.getenv("HOST", "127.0.0.1"),
             )
-            self._log.ok("Connected successfully")
         except KeyError as e:
             self._log.critical("Required env variable %s is unset", e.args[0])
             sys.exit(1)
+        slow_wait = int(os.getenv("POOL_SLOW_WAIT", 100)) / 1000  # milliseconds
+        self._pool = await Pool.create(
+            "interactive",
+            int(os.getenv("POOL_MIN_SIZE", 4)),
+            int(os.getenv("POOL_MAX_SIZE", 10)),
+            slow_wait,
+            **connect_kwargs,
+        )
+        self._background_pool = await Pool.create(
+            "background",
+            int(os.getenv("BACKGROUND_POOL_MIN_SIZE", 1)),
+            int(os.getenv("BACKGROUND_POOL_MAX_SIZE", 4)),
+            slow_wait,
+            **connect_kwargs,
+        )
+        self._log.ok("Connected successfully")
 
         await self.__setup()
         await self.__check_version()
+        await self._load_ranks()
+        if self.points_buffer is not None:
+            self.points_buffer.start()
 
     async def close(self):
+        self._log.info(
+            "User cache: %d hits, %d misses (%.0f%%)",
+            self.users_cache.hits,
+            self.users_cache.misses,
+            self.users_cache.hit_ratio * 100,
+        )
+        if self.points_buffer is not None:
+            self._log.info("Flushing %d pending point updates...", len(self.points_buffer))
+            await self.points_buffer.close()
+        for stats in self.pool_stats():
+            self._log.info("Pool %s", stats)
         self._log.info("Closing database connection...")
-        await self._pool.close()
+        await self._disconnect()
         self._log.ok("Connection was closed successfully")
 
+    async def _disconnect(self):
+        await self._pool.close()
+        await self._background_pool.close()
+
     async def __setup(self):
         self._log.info("Executing setup scripts...")
         with open("sql_config.sql") as f:
@@ -47,35 +139,82 @@ class Database:
     async def __check_version(self):
         self._log.info("Checking database version...")
         version: int = await self.fetchval("SELECT version FROM version_data WHERE id = 0")
-        if self.VERSION > version:
-            self._log.warning("Database is version %d, but bot uses %d, applying migrations...")
-            # TODO migration system
-            self._log.error("Migration system is not implemented yet, update is not possible")
+        migrations = self.__get_migrations()
+        latest = migrations[-1][0] if migrations else version
+        if latest > version:
+            self._log.warning("Database is version %d, but bot uses %d, applying migrations...", version, latest)
+            for migration_version, path in migrations:
+                if migration_version > version:
+                    await self.__apply_migration(migration_version, path)
+            self._log.ok("Database was migrated to version %d", latest)
+            return
+        if latest < version:
+            self._log.warning("Database is version %d, which is newer than bot's %d", version, latest)
             return
         self._log.ok("Database is at latest version")
 
-    async def execute(self, sql, *args):
-        await self._pool.execute(sql, *args)
-
-    async def executemany(self, sql, args):
-        await self._pool.executemany(sql, args)
-
-    async def fetchall(self, sql, *args) -> list[asyncpg.Record]:
-        return await self._pool.fetch(sql, *args)
-
-    async def fetchrow(self, sql, *args) -> asyncpg.Record | None:
-        return await self._pool.fetchrow(sql, *args)
-
-    async def fetchval(self, sql, *args) -> Any | None:
-        return await self._pool.fetchval(sql, *args)
+    def __get_migrations(self) -> list[tuple[int, Path]]:
+        """Returns migration files as (version, path), sorted by version. Files are named like ``002_name.sql``."""
+        migrations = [(int(path.name.split("_", 1)[0]), path) for path in self.MIGRATIONS_PATH.glob("*.sql")]
+        migrations.sort()
+        return migrations
+
+    async def __apply_migration(self, version: int, path: Path):
+        self._log.info("Applying migration %s...", path.name)
+        sql = path.read_text()
+        async with self._background_pool.acquire() as conn:
+            if sql.startswith(self.NO_TRANSACTION_MARK):
+                # statements like CREATE INDEX CONCURRENTLY can't run inside a transaction block, such
+                # migrations are executed statement by statement and must be safe to re-run if interrupted
+                for statement in filter(None, map(str.strip, sql.split(";"))):
+                    await conn.execute(statement)
+                await conn.execute("UPDATE version_data SET version = $1 WHERE id = 0", version)
+            else:
+                async with conn.transaction():
+                    await conn.execute(sql)
+                    await conn.execute("UPDATE version_data SET version = $1 WHERE id = 0", version)
+
+    async def _load_ranks(self):
+        self._log.info("Loading leaderboard...")
+        self.ranks.load(await self.fetchall(SELECT_POINTS_SQL, background=True))
+        self._log.ok("Loaded %d users into leaderboard", len(self.ranks))
+
+    def pool_stats(self) -> list[PoolStats]:
+        return [self._pool.stats(), self._background_pool.stats()]
+
+    def _get_pool(self, background: bool) -> Pool:
+        return self._background_pool if background else self._pool
+
+    async def execute(self, sql, *args, background: bool = False):
+        await self._get_pool(background).execute(sql, *args)
+
+    async def executemany(self, sql, args, background: bool = False):
+        await self._get_pool(background).executemany(sql, args)
+
+    async def fetchall(self, sql, *args, background: bool = False) -> list[asyncpg.Record]:
+        return await self._get_pool(background).fetch(sql, *args)
+
+    async def fetchrow(self, sql, *args, background: bool = False) -> asyncpg.Record | None:
+        return await self._get_pool(background).fetchrow(sql, *args)
+
+    async def fetchval(self, sql, *args, background: bool = False) -> Any | None:
+        return await self._get_pool(background).fetchval(sql, *args)
 
     def get_event_user(self, id: int) -> "EventUser":
         return EventUser(self, id)
 
+    async def load_event_user(self, id: int) -> "EventUser":
+        """Same as ``get_event_user(id).load()``, but served from the users cache when possible."""
+        if (user := self.users_cache.get(id)) is not None:
+            return user
+        generation = self.users_cache.generation
+        user = await self.get_event_user(id).load()
+        self.users_cache.set(id, user, generation)
+        return user
+
     async def create_event(self, id: uuid.UUID, name: str, r_message: Message) -> uuid.UUID:
         await self.execute(
-            "INSERT INTO events (id, name, registration_channel_id, registration_message_id) "
-            "VALUES ($1, $2, $3, $4)",
+            CREATE_EVENT_SQL,
             id,
             name,
             r_message.channel.id,
@@ -85,44 +224,110 @@ class Database:
 
     async def create_group(self, event_id: uuid.UUID, role_id: int, start_time: int):
         await self.execute(
-            "INSERT INTO groups (event_id, start_time, role_id) VALUES ($1, $2, $3)",
+            CREATE_GROUP_SQL,
             event_id,
             start_time,
             role_id,
         )
 
-    async def create_groups(self, groups: list[tuple[int, int, int]]):
+    async def create_groups(self, groups: list[tuple[uuid.UUID, int, datetime]]):
         """:param groups: (event_id, role_id, start_time)"""
-        await self._pool.executemany(
-            "INSERT INTO groups (event_id, role_id, start_time) VALUES ($1, $2, $3)",
-            groups,
+        if not groups:
+            return
+        event_ids, role_ids, start_times = map(list, zip(*groups))
+        await self.execute(
+            CREATE_GROUPS_SQL,
+            event_ids,
+            role_ids,
+            start_times,
         )
 
     async def create_trophy(self, id: str, name: str):
-        await self.execute("INSERT INTO trophies (id, name) VALUES ($1, $2)", id, name)
+        await self.execute(CREATE_TROPHY_SQL, id, name)
 
     async def remove_trophy(self, id: str):
-        await self.execute("DELETE FROM trophies WHERE id = $1", id)
+        await self.execute(REMOVE_TROPHY_SQL, id)
+        self.users_cache.clear()
 
     async def give_trophy(self, user_id: int, trophy_id: str):
         await self.get_event_user(user_id).ensure_existence()
         await self.execute(
-            "INSERT INTO inventories (id, trophy_id) VALUES ($1, $2)",
+            GIVE_TROPHY_SQL,
             user_id,
             trophy_id,
         )
+        self.users_cache.invalidate(user_id)
 
     async def take_trophy(self, user_id: int, trophy_id: str):
         await self.execute(
-            "DELETE FROM inventories WHERE id = $1 AND trophy_id = $2",
+            TAKE_TROPHY_SQL,
             user_id,
             trophy_id,
         )
+        self.users_cache.invalidate(user_id)
+
+    async def add_points_bulk(self, user_ids: Iterable[int], points: int):
+        user_ids = list(set(user_ids))
+        if self.points_buffer is not None:
+            for user_id in user_ids:
+                self.points_buffer.add(user_id, points)
+            return
+        rows = await self.fetchall(
+            ADD_POINTS_BULK_SQL,
+            user_ids,
+            points,
+            background=True,
+        )
+        for row in rows:
+            self.ranks.set(row["id"], row["points"])
+        self.users_cache.invalidate_many(user_ids)
+
+    async def give_trophy_bulk(self, user_ids: Iterable[int], trophy_id: str):
+        user_ids = list(set(user_ids))
+        await self.execute(
+            GIVE_TROPHY_BULK_SQL,
+            user_ids,
+            trophy_id,
+            background=True,
+        )
+        self.users_cache.invalidate_many(user_ids)
+
+    async def register_event_results(self, participants: Iterable[int], winners: Iterable[int]):
+        """Increments ``total_events`` of all participants and ``won_events`` of all winners."""
+        participants = list(set(participants))
+        winners = list(set(winners))
+        await self.execute(
+            REGISTER_EVENT_RESULTS_SQL,
+            participants,
+            winners,
+            background=True,
+        )
+        self.users_cache.invalidate_many(participants + winners)
 
 
 class DataModel:
-    key_field = None
-    table = None
+    key_field: str = None
+    table: str = None
+    # extra computed columns, name -> SQL expression, the key is available as $1
+    computed: dict[str, str] = {}
+
+    _ensure_sql: str
+    _select_sql: str
+    _load_sql: str
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        columns = ", ".join(cls.__annotations__.keys())
+        output = ", ".join([columns] + [f"{sql} AS {name}" for name, sql in cls.computed.items()])
+        cls._ensure_sql = f"INSERT INTO {cls.table} ({cls.key_field}) VALUES ($1) ON CONFLICT DO NOTHING"
+        cls._select_sql = f"SELECT {output} FROM {cls.table} WHERE {cls.key_field} = $1"
+        # the outer SELECT does not see the row inserted by the CTE, so exactly one of both branches yields it
+        cls._load_sql = (
+            f"WITH inserted AS ({cls._ensure_sql} RETURNING {columns}), "
+            f"data AS (SELECT {columns} FROM inserted UNION ALL SELECT {columns} FROM {cls.table} "
+            f"WHERE {cls.key_field} = $1) "
+            f"SELECT {output} FROM data"
+        )
 
     def __init__(self, db: Database, key_value: Any):
         self._db = db
@@ -130,27 +335,23 @@ class DataModel:
         setattr(self, self.key_field, key_value)
 
     async def load(self, ensure_existence: bool = True) -> Self:
-        if ensure_existence:
-            await self.ensure_existence()
-
-        data = await self._db.fetchrow(
-            f"SELECT {', '.join(self.__annotations__.keys())} FROM {self.table} WHERE {self.key_field} = $1",
-            self._key_value,
-        )
-        for k, v in data.items():
-            setattr(self, k, v)
+        data = await self._db.fetchrow(self._load_sql if ensure_existence else self._select_sql, self._key_value)
+        if data is not None:
+            for k, v in data.items():
+                setattr(self, k, v)
 
         return self
 
     async def ensure_existence(self):
-        await self._db.execute(
-            f"INSERT INTO {self.table} ({self.key_field}) VALUES ({self._key_value}) ON CONFLICT DO NOTHING"
-        )
+        await self._db.execute(self._ensure_sql, self._key_value)
 
 
 class EventUser(DataModel):
     key_field = "id"
     table = "users"
+    computed = {
+        "trophy_ids": "ARRAY(SELECT trophy_id FROM inventories WHERE id = $1 ORDER BY obtained_on DESC LIMIT 7)",
+    }
 
     id: int
     points: int
@@ -163,16 +364,19 @@ class EventUser(DataModel):
 
     async def load(self, ensure_existence: bool = True) -> Self:
         await super().load(ensure_existence)
-        data = await self._db.fetchall(
-            "SELECT trophy_id FROM inventories WHERE id = $1 ORDER BY obtained_on DESC LIMIT 7",
-            self.id,
-        )
-        self.trophy_ids = [row["trophy_id"] for row in data]
+        if self._db.points_buffer is not None:
+            self.points = (self.points or 0) + self._db.points_buffer.pending(self.id)
+        self._db.ranks.set(self.id, self.points or 0)
         return self
 
-    async def get_lb_pos(self) -> int:
-        return await self._db.fetchval("SELECT COUNT(*) FROM users WHERE points >= $1", self.points)
+    def get_lb_pos(self) -> int:
+        return self._db.ranks.rank(self.points or 0)
 
     async def update_event_points(self, delta: int):
+        if self._db.points_buffer is not None:
+            self._db.points_buffer.add(self.id, delta)
+            return
         await self.ensure_existence()
-        await self._db.execute("UPDATE users SET points = points + $2 WHERE id = $1", self.id, delta)
+        points: int = await self._db.fetchval(UPDATE_POINTS_SQL, self.id, delta)
+        self._db.ranks.set(self.id, points)
+        self._db.users_cache.invalidate(self.id)
@@ -5,6 +5,13 @@ def fnum(n: int) -> str:
     return f"{n:,}".replace(",", " ")
 
 
+def fduration(seconds: float) -> str:
+    """Formats a duration as ``H:MM:SS``, hours are not wrapped into days."""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}"
+
+
 def emoji_enum(options: list[str]) -> str:
     txt = ""
     for e, option in zip(ENUMERATION_EMOJIS, options):
@@ -0,0 +1,34 @@
+import numpy as np
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling, keeps the points that shape the line the most.
+
+    :param x: Ascending x coordinates as numbers.
+    :param y: Values at ``x``.
+    :param threshold: Number of points to keep, e.g. the width of the plot in pixels.
+    :return: Indices of the kept points, the first and the last point are always kept.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = x.astype(np.float64, copy=False)
+    y = y.astype(np.float64, copy=False)
+    indices = np.empty(threshold, dtype=np.intp)
+    indices[0] = 0
+    indices[-1] = n - 1
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        # the third vertex of the triangles is the average of the next bucket
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(areas.argmax())
+        indices[i + 1] = a
+    return indices
@@ -0,0 +1,64 @@
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+from utils.logs import Logger
+
+
+class EditScheduler:
+    """
+    Debounces message edits per message and runs edits of different messages concurrently.
+
+    The first request after a quiet period is served after ``delay``; messages that keep
+    receiving requests are edited at most once per ``window`` seconds, with all requests
+    in between coalesced into that edit. Edits in the same channel share Discord's rate
+    limit bucket, so they are serialized, while ``concurrency`` caps edits in flight overall.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[int], Awaitable[None]],
+        delay: float = 0.5,
+        window: float = 5,
+        concurrency: int = 5,
+    ):
+        """:param callback: Coroutine function performing the edit, called with the message ID."""
+        self.delay = delay
+        self.window = window
+        self._callback = callback
+        self._log = Logger("EDITS")
+        self._scheduled: dict[int, asyncio.Task] = {}
+        self._last_edit: dict[int, float] = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._channel_locks: dict[int, asyncio.Lock] = {}
+
+    def request(self, message_id: int, channel_id: int):
+        if message_id in self._scheduled:
+            return  # will be covered by the edit that is already scheduled
+        self._scheduled[message_id] = asyncio.create_task(self._edit(message_id, channel_id))
+
+    def cancel(self, message_id: int):
+        if (task := self._scheduled.pop(message_id, None)) is not None:
+            task.cancel()
+        self._last_edit.pop(message_id, None)
+
+    async def _edit(self, message_id: int, channel_id: int):
+        last_edit = self._last_edit.get(message_id)
+        delay = self.delay if last_edit is None else max(self.delay, last_edit + self.window - time.monotonic())
+        await asyncio.sleep(delay)
+
+        lock = self._channel_locks.setdefault(channel_id, asyncio.Lock())
+        # waiting for a busy channel must not hold a concurrency slot other channels could use
+        async with lock, self._semaphore:
+            # requests made from now on need another edit, as this one may already miss them
+            del self._scheduled[message_id]
+            self._last_edit[message_id] = time.monotonic()
+            try:
+                await self._callback(message_id)
+            except Exception:
+                self._log.exception("Failed to edit message %d", message_id)
+
+        now = time.monotonic()
+        for id, edited_at in list(self._last_edit.items()):
+            if edited_at + self.window < now and id not in self._scheduled:
+                del self._last_edit[id]
@@ -1,25 +1,40 @@
-import asyncio
-import os
+import hashlib
 from io import BytesIO
-from pathlib import Path
-from typing import Sequence
-from urllib.request import build_opener, install_opener, urlopen
+from typing import Callable, Sequence
 
-import disnake
-import matplotlib.pyplot as plt
 import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from PIL import Image, ImageDraw, ImageFont, ImageOps
 
+from utils.avatars import AVATAR_SIZE
+from utils.cache import LRUCache
 from utils.database import EventUser
 from utils.deco import fnum
+from utils.downsampling import lttb
+from utils.image_output import OutputSettings, encode_image
+from utils.renderer import Renderer
+from utils.trophies import TROPHY_SIZE, trophy_thumbnails
 
-opener = build_opener()
-opener.addheaders = [("Authorization", f"Bot {os.environ['TOKEN']}")]
-install_opener(opener)
+# render functions run in worker processes, their arguments are plain values rather than bot objects
+renderer = Renderer.from_env()
 
+# encoded images by hash of the render inputs, capped by their total size in bytes
+RENDER_CACHE: LRUCache[bytes, bytes] = LRUCache(32 * 1024 * 1024, sizeof=len)
 
+# the cards are opaque and mostly flat, JPEG encodes them an order of magnitude faster than PNG
+PROF_OUTPUT = OutputSettings("jpeg", quality=90, max_bytes=512 * 1024)
+STATS_OUTPUT = OutputSettings("jpeg", quality=90, max_bytes=512 * 1024)
+# thin lines blur in lossy formats, while a plot of a few flat colors compresses well as PNG
+ACTIVITY_OUTPUT = OutputSettings("png", max_bytes=256 * 1024)
+
+ACTIVITY_PLOT_SIZE = (9, 5)
+ACTIVITY_PLOT_DPI = 80
+ACTIVITY_PLOT_POINTS = ACTIVITY_PLOT_SIZE[0] * ACTIVITY_PLOT_DPI
+
+# the templates are opaque, RGB saves dropping the alpha channel from every render
 with Image.open("res/templates/profile.png") as img:
-    PROF_BASE_IMAGE = img.copy()
+    PROF_BASE_IMAGE = img.convert("RGB")
 
 PROF_NAME_FONT = ImageFont.truetype("res/fonts/Neucha.ttf", 122)
 PROF_NAME_COLOR = "#38FFF5"
@@ -30,7 +45,7 @@ PROF_LB_COLOR = "#42F2F4"
 PROF_LB_POS = (1892, 172)
 
 PROF_PFP_POS = (333, 589)
-PROF_PFP_SIZE = (316, 316)
+PROF_PFP_SIZE = AVATAR_SIZE
 
 PROF_STATS_FONT = ImageFont.truetype("res/fonts/Neucha.ttf", 94)
 PROF_STATS_COLOR = "#F7F73E"
@@ -41,7 +56,7 @@ PROF_STATS_POS_Y_STOP = PROF_STATS_POS_Y_START + PROF_STATS_POS_Y_STEP * 2 + 1
 
 PROF_TR_EMPTY_COLOR = "#EBEBEB"
 PROF_TR_EMPTY_SIZE = (48, 48)
-PROF_TR_TROPHY_SIZE = (130, 130)
+PROF_TR_TROPHY_SIZE = TROPHY_SIZE
 PROF_TR_POS_Y = 835
 PROF_TR_POS_X_START = 694
 PROF_TR_POS_X_STEP = 180
@@ -49,7 +64,7 @@ PROF_TR_POS_X_STOP = PROF_TR_POS_X_START + PROF_TR_POS_X_STEP * 6 + 1
 
 
 with Image.open("res/templates/stats.png") as img:
-    STATS_BASE_IMAGE = img.copy()
+    STATS_BASE_IMAGE = img.convert("RGB")
 
 STATS_NAME_FONT = ImageFont.truetype("res/fonts/LuckiestGuy.ttf", 142)
 STATS_NAME_COLOR = "#38FFF5"
@@ -81,13 +96,6 @@ def circle_img(im: Image.Image) -> Image.Image:
     return out
 
 
-def get_mask(size: tuple[int, int]) -> Image.Image:
-    mask = Image.new("L", size)
-    draw = ImageDraw.Draw(mask)
-    draw.ellipse((0, 0) + size, fill="#fff")
-    return mask
-
-
 def center_to_box(center: tuple[int, int], size: tuple[int, int]) -> tuple[int, int, int, int]:
     s0 = size[0] // 2
     s1 = size[1] // 2
@@ -96,6 +104,36 @@ def center_to_box(center: tuple[int, int], size: tuple[int, int]) -> tuple[int,
     return c0 - s0, c1 - s1, c0 + s0, c1 + s1
 
 
+def _trophy_placeholder(pos_x: int) -> tuple[tuple[int, int], Image.Image]:
+    x0, y0, x1, y1 = center_to_box((pos_x, PROF_TR_POS_Y), PROF_TR_EMPTY_SIZE)
+    tile = PROF_BASE_IMAGE.crop((x0, y0, x1 + 1, y1 + 1))  # the ellipse box is inclusive
+    ImageDraw.Draw(tile).ellipse((0, 0, x1 - x0, y1 - y0), fill=PROF_TR_EMPTY_COLOR)
+    return (x0, y0), tile
+
+
+# template regions of the empty trophy slots with the placeholder already drawn, pasted as they are
+PROF_TR_PLACEHOLDERS = [
+    _trophy_placeholder(pos_x) for pos_x in range(PROF_TR_POS_X_START, PROF_TR_POS_X_STOP, PROF_TR_POS_X_STEP)
+]
+
+
+def render_key(*inputs) -> bytes:
+    return hashlib.blake2b(repr(inputs).encode(), digest_size=16).digest()
+
+
+async def render_cached(key: bytes, render: Callable[..., BytesIO], *args) -> BytesIO:
+    """
+    Returns the cached image with ``key`` or calls ``render`` with ``args`` in the renderer and caches its result.
+
+    :raise RendererBusy: The image is not cached and the renderer is overloaded.
+    """
+    if (data := RENDER_CACHE.get(key)) is None:
+        io = await renderer.submit(render, *args)
+        data = io.getvalue()
+        RENDER_CACHE.set(key, data)
+    return BytesIO(data)
+
+
 async def draw_statistics_card(
     channel_name: str,
     track_time: str,
@@ -103,15 +141,8 @@ async def draw_statistics_card(
     total_participants: int,
     top_users: Sequence[str],
 ) -> BytesIO:
-    return await asyncio.get_event_loop().run_in_executor(
-        None,
-        __draw_statistics_card,
-        channel_name,
-        track_time,
-        messages_sent,
-        total_participants,
-        top_users,
-    )
+    args = (channel_name, track_time, messages_sent, total_participants, tuple(top_users))
+    return await render_cached(render_key("statistics", *args), __draw_statistics_card, *args)
 
 
 def __draw_statistics_card(
@@ -162,28 +193,47 @@ def __draw_statistics_card(
             align="right",
         )
 
-    io = BytesIO()
-    image.save(io, format="png")
-    io.seek(0)
-    return io
+    return encode_image(image, STATS_OUTPUT)
 
 
 async def draw_profile_card(
-    user: disnake.Member,
+    name: str,
+    avatar: Image.Image,
+    avatar_key: str,
     event_user: EventUser,
 ) -> BytesIO:
-    return await asyncio.get_event_loop().run_in_executor(
-        None, __draw_profile_card, user, await event_user.get_lb_pos(), event_user
+    """
+    :param avatar: A circled avatar of ``PROF_PFP_SIZE``, see ``utils.avatars.AvatarCache``.
+    :param avatar_key: The hash of the avatar, identifies it in the render cache.
+    """
+    stats = (
+        event_user.get_lb_pos(),
+        event_user.points,
+        event_user.total_events,
+        event_user.won_events,
+        tuple(event_user.trophy_ids),
     )
-
-
-def __draw_profile_card(user: disnake.Member, lb_pos: int, event_user: EventUser) -> BytesIO:
+    # the generation keeps profiles drawn with a replaced trophy picture out of the render cache of this process,
+    # the thumbnails the workers draw with are revalidated by them, see ``TrophyThumbnails.drop``
+    key = render_key("profile", name, avatar_key, trophy_thumbnails.generation, *stats)
+    return await render_cached(key, __draw_profile_card, name, avatar, *stats)
+
+
+def __draw_profile_card(
+    name: str,
+    avatar: Image.Image,
+    lb_pos: int,
+    points: int,
+    total_events: int,
+    won_events: int,
+    trophy_ids: Sequence[str],
+) -> BytesIO:
     image = PROF_BASE_IMAGE.copy()
     draw = ImageDraw.Draw(image)
 
     draw.text(
         xy=PROF_NAME_POS,
-        text=str(user),
+        text=name,
         fill=PROF_NAME_COLOR,
         font=PROF_NAME_FONT,
         anchor="lm",
@@ -199,13 +249,11 @@ def __draw_profile_card(user: disnake.Member, lb_pos: int, event_user: EventUser
         align="right",
     )
 
-    with Image.open(urlopen(user.display_avatar.url)) as pfp:
-        pfp = pfp.resize(PROF_PFP_SIZE)
-        image.paste(pfp, center_to_box(PROF_PFP_POS, PROF_PFP_SIZE), get_mask(PROF_PFP_SIZE))
+    image.paste(avatar, center_to_box(PROF_PFP_POS, PROF_PFP_SIZE), avatar)
 
     for pos_y, stat in zip(
         range(PROF_STATS_POS_Y_START, PROF_STATS_POS_Y_STOP, PROF_STATS_POS_Y_STEP),
-        [fnum(event_user.points), event_user.total_events, event_user.won_events],
+        [fnum(points), total_events, won_events],
     ):
         draw.text(
             xy=(PROF_STATS_POS_X, pos_y),
@@ -217,51 +265,50 @@ def __draw_profile_card(user: disnake.Member, lb_pos: int, event_user: EventUser
         )
 
     for i, pos_x in enumerate(range(PROF_TR_POS_X_START, PROF_TR_POS_X_STOP, PROF_TR_POS_X_STEP)):
-        if len(event_user.trophy_ids) <= i:
-            draw.ellipse(
-                center_to_box((pos_x, PROF_TR_POS_Y), PROF_TR_EMPTY_SIZE),
-                fill=PROF_TR_EMPTY_COLOR,
-            )
+        if len(trophy_ids) <= i:
+            image.paste(PROF_TR_PLACEHOLDERS[i][1], PROF_TR_PLACEHOLDERS[i][0])
         else:
-            with Image.open(Path("data/trophies/", event_user.trophy_ids[i] + ".png")) as tr:
-                resized_tr = tr.resize(PROF_TR_TROPHY_SIZE)
-                image.paste(
-                    resized_tr,
-                    center_to_box((pos_x, PROF_TR_POS_Y), PROF_TR_TROPHY_SIZE),
-                    resized_tr.convert("RGBA"),
-                )
+            tr = trophy_thumbnails.get(trophy_ids[i])
+            image.paste(tr, center_to_box((pos_x, PROF_TR_POS_Y), PROF_TR_TROPHY_SIZE), tr)
 
-    io = BytesIO()
-    image.save(io, format="png")
-    io.seek(0)
-    return io
+    return encode_image(image, PROF_OUTPUT)
 
 
-async def draw_activity_plot(data: list[dict]) -> BytesIO:
-    return await asyncio.get_event_loop().run_in_executor(None, __draw_activity_plot, data)
+async def draw_activity_plot(
+    times: Sequence[int],
+    online: Sequence[int],
+    idle: Sequence[int],
+    dnd: Sequence[int],
+) -> BytesIO:
+    """:param times: Epoch seconds of the samples, ascending."""
+    series = (
+        np.array(times, dtype=np.int64).astype("datetime64[s]"),
+        np.array(online, dtype=np.int32),
+        np.array(idle, dtype=np.int32),
+        np.array(dnd, dtype=np.int32),
+    )
+    return await render_cached(render_key("activity", *(a.tobytes() for a in series)), __draw_activity_plot, *series)
 
 
-def __draw_activity_plot(d: list[dict]) -> BytesIO:
-    """
-    :param d: A dict with items in the following order: [time, online, idle, dnd]
-    :return: A BytesIO with plot saved into, seeked to 0
-    """
-    data = np.array([list(e.values()) for e in d])
-    x = data[:, 0]
-    online = data[:, 1]
-    idle = data[:, 2]
-    dnd = data[:, 3]
+def __draw_activity_plot(times: np.ndarray, online: np.ndarray, idle: np.ndarray, dnd: np.ndarray) -> BytesIO:
+    """:return: A BytesIO with plot saved into, seeked to 0"""
     total = online + idle + dnd
-
-    plt.figure(figsize=(9, 5), dpi=80)
-    plt.plot(x, total, "-g", x, online, ":g", x, idle, ":y", x, dnd, ":r")
-    plt.title("Activity Data")
-    plt.xlabel("Time")
-    plt.ylabel("Online users")
-    plt.grid(linestyle="--", linewidth=0.5)
-    plt.legend(["total", "online", "idle", "dnd"])
-
-    io = BytesIO()
-    plt.savefig(io)
-    io.seek(0)
-    return io
+    x = times.astype(np.int64)
+
+    # a standalone figure is not registered in pyplot's global state, so concurrent renders
+    # don't draw on each other's plots and it is freed as soon as it goes out of scope
+    fig = Figure(figsize=ACTIVITY_PLOT_SIZE, dpi=ACTIVITY_PLOT_DPI)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    for y, style in ((total, "-g"), (online, ":g"), (idle, ":y"), (dnd, ":r")):
+        # more points than pixels only cost time, downsampling keeps the peaks and dips visible
+        indices = lttb(x, y, ACTIVITY_PLOT_POINTS)
+        ax.plot(times[indices], y[indices], style)
+    ax.set_title("Activity Data")
+    ax.set_xlabel("Time")
+    ax.set_ylabel("Online users")
+    ax.grid(linestyle="--", linewidth=0.5)
+    ax.legend(["total", "online", "idle", "dnd"])
+
+    canvas.draw()
+    return encode_image(Image.frombuffer("RGBA", canvas.get_width_height(), canvas.buffer_rgba()), ACTIVITY_OUTPUT)
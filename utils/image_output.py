@@ -0,0 +1,67 @@
+from dataclasses import dataclass
+from io import BytesIO
+
+from PIL import Image
+
+MIN_QUALITY = 50
+MIN_WIDTH = 480
+BUDGET_DOWNSCALE = 0.75
+
+
+@dataclass(frozen=True, slots=True)
+class OutputSettings:
+    """
+    How a renderer encodes its images.
+
+    :param format: ``png``, ``webp`` or ``jpeg``.
+    :param compress_level: zlib level of PNGs, lower is faster and bigger.
+    :param optimize: Let PNG and JPEG encoders spend extra time on a smaller file.
+    :param quality: Quality of WebPs and JPEGs.
+    :param scale: Factor the image is resized by before encoding.
+    :param max_bytes: Size budget, lossy formats lower their quality and then all formats downscale until it's met.
+    """
+
+    format: str = "png"
+    compress_level: int = 6
+    optimize: bool = False
+    quality: int = 90
+    scale: float = 1.0
+    max_bytes: int | None = None
+
+    @property
+    def extension(self) -> str:
+        return "jpg" if self.format == "jpeg" else self.format
+
+    def filename(self, name: str) -> str:
+        return f"{name}.{self.extension}"
+
+    def save_params(self, quality: int) -> dict:
+        if self.format == "png":
+            return {"compress_level": self.compress_level, "optimize": self.optimize}
+        if self.format == "jpeg":
+            return {"quality": quality, "optimize": self.optimize}
+        return {"quality": quality}
+
+
+def encode_image(image: Image.Image, settings: OutputSettings) -> BytesIO:
+    """:return: A BytesIO with the encoded image, seeked to 0"""
+    if settings.scale != 1:
+        image = image.resize((round(image.width * settings.scale), round(image.height * settings.scale)), Image.LANCZOS)
+    if settings.format == "jpeg" and image.mode != "RGB":
+        image = image.convert("RGB")
+
+    quality = settings.quality
+    while True:
+        io = BytesIO()
+        image.save(io, format=settings.format, **settings.save_params(quality))
+        if settings.max_bytes is None or io.tell() <= settings.max_bytes:
+            break
+        if settings.format != "png" and quality > MIN_QUALITY:
+            quality = max(MIN_QUALITY, quality - 10)
+        elif image.width * BUDGET_DOWNSCALE >= MIN_WIDTH:
+            size = (round(image.width * BUDGET_DOWNSCALE), round(image.height * BUDGET_DOWNSCALE))
+            image = image.resize(size, Image.LANCZOS)
+        else:
+            break  # over budget, but still better than no image at all
+    io.seek(0)
+    return io
@@ -0,0 +1,719 @@
+import asyncio
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Callable, Iterator
+
+import asyncpg
+
+from utils.database import (
+    ADD_POINTS_BULK_SQL,
+    CLOSE_GROUPS_SQL,
+    CREATE_EVENT_SQL,
+    CREATE_GROUP_SQL,
+    CREATE_GROUPS_SQL,
+    CREATE_TROPHY_SQL,
+    EVENT_EXISTS_SQL,
+    GIVE_TROPHY_BULK_SQL,
+    GIVE_TROPHY_SQL,
+    REGISTER_EVENT_RESULTS_SQL,
+    REMOVE_EVENT_SQL,
+    REMOVE_TROPHY_SQL,
+    SELECT_EVENTS_SQL,
+    SELECT_GROUP_ROLES_SQL,
+    SELECT_GROUPS_TO_CLOSE_SQL,
+    SELECT_POINTS_SQL,
+    SELECT_REGISTRATION_CHANNEL_SQL,
+    SELECT_REGISTRATION_SQL,
+    TAKE_TROPHY_SQL,
+    TROPHY_EXISTS_SQL,
+    UPDATE_POINTS_SQL,
+    Database,
+    EventUser,
+)
+from utils.points_buffer import FLUSH_SQL, SELECT_POINTS_OF_SQL
+from utils.poll_state import (
+    COUNT_ALL_VOTES_SQL,
+    COUNT_POLL_VOTES_SQL,
+    CREATE_POLL_SQL,
+    REMOVE_POLLS_SQL,
+    SELECT_POLLS_SQL,
+    VOTE_SQL,
+)
+from utils.pool import PoolStats
+from utils.stats_rollups import DELETE_OLD_STATS_SQL, RECORD_STATS_SQL, ROLLUPS, STATS_COLUMNS
+from utils.tracking import (
+    CHECKPOINT_SQL,
+    CREATE_SESSION_SQL,
+    REMOVE_SESSION_SQL,
+    SELECT_SESSION_MINUTES_SQL,
+    SELECT_SESSION_USERS_SQL,
+    SELECT_SESSIONS_SQL,
+)
+
+
+class Record(dict):
+    """Minimal stand-in for ``asyncpg.Record``, supports lookups both by column name and by position."""
+
+    def __getitem__(self, key: str | int) -> Any:
+        if isinstance(key, int):
+            return list(self.values())[key]
+        return super().__getitem__(key)
+
+
+class Journal:
+    """Collects undo actions of the running statement, so a failed statement leaves no changes behind."""
+
+    def __init__(self):
+        self._entries: list[Callable[[], None]] | None = None
+
+    @contextmanager
+    def statement(self) -> Iterator[None]:
+        self._entries = []
+        try:
+            yield
+        except BaseException:
+            for undo in reversed(self._entries):
+                undo()
+            raise
+        finally:
+            self._entries = None
+
+    def record(self, undo: Callable[[], None]):
+        if self._entries is not None:
+            self._entries.append(undo)
+
+
+class Table:
+    """
+    In-memory table with hash indexes.
+
+    Enforces the same unique, foreign key (``ON DELETE CASCADE``) and check
+    constraints as ``sql_config.sql`` and raises the same asyncpg exceptions.
+    """
+
+    def __init__(
+        self,
+        journal: Journal,
+        name: str,
+        columns: dict[str, Any],
+        primary_key: tuple[str, ...] | None = None,
+        unique: tuple[tuple[str, ...], ...] = (),
+        indexes: tuple[tuple[str, ...], ...] = (),
+        checks: dict[str, Callable[[dict], bool]] | None = None,
+    ):
+        """:param columns: column name -> default value, or a callable producing it"""
+        self.name = name
+        self.columns = columns
+        self.primary_key = primary_key
+        self._journal = journal
+        self._rows: dict[int, dict] = {}
+        self._unique: dict[tuple[str, ...], dict[tuple, dict]] = {
+            cols: {} for cols in ((primary_key,) if primary_key else ()) + unique
+        }
+        self._indexes: dict[tuple[str, ...], dict[tuple, dict[int, dict]]] = {cols: {} for cols in indexes}
+        self._checks = checks or {}
+        self._references: dict[str, Table] = {}
+        self._referenced_by: list[tuple[Table, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(list(self._rows.values()))
+
+    def references(self, column: str, parent: "Table"):
+        self._references[column] = parent
+        parent._referenced_by.append((self, column))
+        if (column,) not in self._indexes:
+            self._indexes[(column,)] = {}
+
+    def get(self, cols: tuple[str, ...], key: tuple) -> dict | None:
+        return self._unique[cols].get(key)
+
+    def find(self, cols: tuple[str, ...], key: tuple) -> list[dict]:
+        if cols in self._unique:
+            row = self._unique[cols].get(key)
+            return [] if row is None else [row]
+        if cols in self._indexes:
+            return list(self._indexes[cols].get(key, {}).values())
+        return [row for row in self._rows.values() if self._key(row, cols) == key]
+
+    def insert(
+        self,
+        values: dict[str, Any],
+        on_conflict: tuple[str, ...] | None = None,
+        update: Callable[[dict, dict], dict] | None = None,
+    ) -> dict | None:
+        """
+        :param on_conflict: Columns of the unique constraint to handle conflicts on, ``()`` handles any constraint.
+        :param update: Called with (existing, excluded) row on conflict, returns the changes. If not set,
+            conflicting rows are skipped.
+        :return: The inserted or updated row, ``None`` if nothing happened.
+        """
+        unknown = values.keys() - self.columns.keys()
+        if unknown:
+            raise asyncpg.UndefinedColumnError(f'column "{unknown.pop()}" of relation "{self.name}" does not exist')
+        row = {column: default() if callable(default) else default for column, default in self.columns.items()}
+        row.update(values)
+
+        if on_conflict is not None and (conflict := self._conflict(row)) is not None:
+            cols, existing = conflict
+            if on_conflict == () or on_conflict == cols:
+                return None if update is None else self.update(existing, update(existing, row))
+
+        self._validate(row)
+        self._link(row)
+        self._journal.record(lambda: self._unlink(row))
+        return row
+
+    def update(self, row: dict, changes: dict[str, Any]) -> dict:
+        self._validate({**row, **changes}, row)
+        old = dict(row)
+
+        def undo():
+            self._unlink(row)
+            row.update(old)
+            self._link(row)
+
+        self._unlink(row)
+        row.update(changes)
+        self._link(row)
+        self._journal.record(undo)
+        return row
+
+    def delete(self, row: dict):
+        if self.primary_key is not None:
+            key = self._key(row, self.primary_key)
+            for child, column in self._referenced_by:
+                for child_row in child.find((column,), key):
+                    child.delete(child_row)
+        self._unlink(row)
+        self._journal.record(lambda: self._link(row))
+
+    @staticmethod
+    def _key(row: dict, cols: tuple[str, ...]) -> tuple:
+        return tuple(row[column] for column in cols)
+
+    def _conflict(self, row: dict, ignore: dict | None = None) -> tuple[tuple[str, ...], dict] | None:
+        for cols, index in self._unique.items():
+            key = self._key(row, cols)
+            if None in key:
+                continue
+            existing = index.get(key)
+            if existing is not None and existing is not ignore:
+                return cols, existing
+        return None
+
+    def _validate(self, row: dict, old: dict | None = None):
+        for name, check in self._checks.items():
+            if not check(row):
+                raise asyncpg.CheckViolationError(
+                    f'new row for relation "{self.name}" violates check constraint "{name}"'
+                )
+        if (conflict := self._conflict(row, old)) is not None:
+            raise asyncpg.UniqueViolationError(
+                f'duplicate key value violates unique constraint "{self.name}_{"_".join(conflict[0])}_key"'
+            )
+        for column, parent in self._references.items():
+            if row[column] is not None and parent.get(parent.primary_key, (row[column],)) is None:
+                raise asyncpg.ForeignKeyViolationError(
+                    f'insert or update on table "{self.name}" violates '
+                    f'foreign key constraint "{self.name}_{column}_fkey"'
+                )
+
+    def _link(self, row: dict):
+        self._rows[id(row)] = row
+        for cols, index in self._unique.items():
+            key = self._key(row, cols)
+            if None not in key:
+                index[key] = row
+        for cols, index in self._indexes.items():
+            index.setdefault(self._key(row, cols), {})[id(row)] = row
+
+    def _unlink(self, row: dict):
+        del self._rows[id(row)]
+        for cols, index in self._unique.items():
+            key = self._key(row, cols)
+            if index.get(key) is row:
+                del index[key]
+        for cols, index in self._indexes.items():
+            key = self._key(row, cols)
+            bucket = index[key]
+            del bucket[id(row)]
+            if not bucket:
+                del index[key]
+
+
+class UnsupportedStatement(Exception):
+    """Raised for SQL that no method of ``MemoryDatabase`` implements."""
+
+
+STATEMENTS: dict[str, Callable[..., list[Record]]] = {}
+
+
+def normalize(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+def statement(*sqls: str):
+    """Registers the decorated method as the implementation of the given SQL statements."""
+
+    def decorator(func: Callable[..., list[Record]]) -> Callable[..., list[Record]]:
+        for sql in sqls:
+            STATEMENTS[normalize(sql)] = func
+        return func
+
+    return decorator
+
+
+def epoch(time: datetime) -> float:
+    """Like ``EXTRACT(EPOCH FROM time)`` on a ``TIMESTAMP``, the naive time is taken as UTC."""
+    return (time - datetime(1970, 1, 1)).total_seconds()
+
+
+def pick(row: dict | None, *columns: str) -> list[Record]:
+    return [] if row is None else [Record({column: row[column] for column in columns})]
+
+
+class MemoryDatabase(Database):
+    """
+    In-process drop-in for ``Database``, meant for load testing and profiling without Postgres.
+
+    Supports exactly the statements the bot issues, each one implemented on top
+    of indexed ``Table`` objects. Statements are atomic and yield to the event
+    loop once, like a query with zero latency would.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._journal = Journal()
+        j = self._journal
+        now = datetime.now
+
+        self.trophies = Table(j, "trophies", {"id": None, "name": None}, primary_key=("id",))
+        self.users = Table(
+            j,
+            "users",
+            {"id": None, "points": 0, "total_events": 0, "won_events": 0},
+            primary_key=("id",),
+            checks={"users_points_check": lambda row: row["points"] is None or row["points"] >= 0},
+        )
+        self.inventories = Table(
+            j,
+            "inventories",
+            {"id": None, "trophy_id": None, "obtained_on": now},
+            unique=(("id", "trophy_id"),),
+        )
+        self.inventories.references("id", self.users)
+        self.inventories.references("trophy_id", self.trophies)
+        self.events = Table(
+            j,
+            "events",
+            {
+                "id": None,
+                "name": None,
+                "created_at": now,
+                "registration_channel_id": None,
+                "registration_message_id": None,
+            },
+            primary_key=("id",),
+        )
+        self.groups = Table(
+            j,
+            "groups",
+            {"event_id": None, "start_time": None, "role_id": None, "closed": False},
+            unique=(("event_id", "role_id"),),
+        )
+        self.groups.references("event_id", self.events)
+        self.stats = Table(j, "stats", {"time": now, "online": None, "idle": None, "dnd": None})
+        self.tracking_sessions = Table(
+            j, "tracking_sessions", {"channel_id": None, "started_at": None}, primary_key=("channel_id",)
+        )
+        self.tracking_users = Table(
+            j,
+            "tracking_users",
+            {"channel_id": None, "user_id": None, "messages": None},
+            primary_key=("channel_id", "user_id"),
+        )
+        self.tracking_users.references("channel_id", self.tracking_sessions)
+        self.tracking_minutes = Table(
+            j,
+            "tracking_minutes",
+            {"channel_id": None, "minute": None, "messages": None},
+            primary_key=("channel_id", "minute"),
+        )
+        self.tracking_minutes.references("channel_id", self.tracking_sessions)
+        self.rollups = {
+            rollup.table: Table(
+                j,
+                rollup.table,
+                {"bucket": None, "samples": None}
+                | {f"{column}_{agg}": None for column in STATS_COLUMNS for agg in ("min", "max", "sum")},
+                primary_key=("bucket",),
+            )
+            for rollup in ROLLUPS
+        }
+        self.polls = Table(
+            j,
+            "polls",
+            {"message_id": None, "option_id": None, "member_id": None},
+            unique=(("message_id", "member_id"),),
+            indexes=(("message_id",), ("message_id", "option_id")),
+        )
+        self.polls_messages = Table(j, "polls_messages", {"message_id": None}, unique=(("message_id",),))
+
+    async def connect(self):
+        self._log.info("Using in-memory database")
+        await self._load_ranks()
+        if self.points_buffer is not None:
+            self.points_buffer.start()
+
+    async def _disconnect(self):
+        pass
+
+    def pool_stats(self) -> list[PoolStats]:
+        return []
+
+    @staticmethod
+    def _handler(sql: str) -> Callable[..., list[Record]]:
+        """:raise UnsupportedStatement: No method implements ``sql``."""
+        handler = STATEMENTS.get(normalize(sql))
+        if handler is None:
+            raise UnsupportedStatement(f"Statement is not supported by the in-memory database: {sql}")
+        return handler
+
+    async def _run(self, sql: str, args: tuple) -> list[Record]:
+        handler = self._handler(sql)
+        await asyncio.sleep(0)
+        with self._journal.statement():
+            return handler(self, *args)
+
+    async def execute(self, sql, *args, background: bool = False):
+        await self._run(sql, args)
+
+    async def executemany(self, sql, args, background: bool = False):
+        handler = self._handler(sql)
+        await asyncio.sleep(0)
+        with self._journal.statement():
+            for arg in args:
+                handler(self, *arg)
+
+    async def fetchall(self, sql, *args, background: bool = False) -> list[Record]:
+        return await self._run(sql, args)
+
+    async def fetchrow(self, sql, *args, background: bool = False) -> Record | None:
+        rows = await self._run(sql, args)
+        return rows[0] if rows else None
+
+    async def fetchval(self, sql, *args, background: bool = False) -> Any | None:
+        rows = await self._run(sql, args)
+        return rows[0][0] if rows else None
+
+    # users
+
+    def _user_record(self, row: dict | None) -> list[Record]:
+        if row is None:
+            return []
+        inventory = self.inventories.find(("id",), (row["id"],))
+        inventory.sort(key=lambda e: e["obtained_on"], reverse=True)
+        records = pick(row, *EventUser.__annotations__.keys())
+        records[0]["trophy_ids"] = [e["trophy_id"] for e in inventory[:7]]
+        return records
+
+    @statement(EventUser._load_sql)
+    def _load_user(self, id: int) -> list[Record]:
+        self.users.insert({"id": id}, on_conflict=())
+        return self._user_record(self.users.get(("id",), (id,)))
+
+    @statement(EventUser._select_sql)
+    def _select_user(self, id: int) -> list[Record]:
+        return self._user_record(self.users.get(("id",), (id,)))
+
+    @statement(EventUser._ensure_sql)
+    def _ensure_user(self, id: int) -> list[Record]:
+        self.users.insert({"id": id}, on_conflict=())
+        return []
+
+    @statement(SELECT_POINTS_SQL)
+    def _select_points(self) -> list[Record]:
+        return [Record(id=row["id"], points=row["points"]) for row in self.users]
+
+    @statement(SELECT_POINTS_OF_SQL)
+    def _select_points_of(self, ids: list[int]) -> list[Record]:
+        return [r for id in ids for r in pick(self.users.get(("id",), (id,)), "id", "points")]
+
+    @statement(UPDATE_POINTS_SQL)
+    def _update_points(self, id: int, delta: int) -> list[Record]:
+        row = self.users.get(("id",), (id,))
+        if row is None:
+            return []
+        return pick(self.users.update(row, {"points": row["points"] + delta}), "points")
+
+    @statement(ADD_POINTS_BULK_SQL)
+    def _add_points_bulk(self, ids: list[int], points: int) -> list[Record]:
+        return self._add_points(ids, [points] * len(ids))
+
+    @statement(FLUSH_SQL)
+    def _add_points(self, ids: list[int], deltas: list[int]) -> list[Record]:
+        records = []
+        for id, delta in zip(ids, deltas):
+            row = self.users.insert(
+                {"id": id, "points": delta},
+                on_conflict=("id",),
+                update=lambda old, new: {"points": old["points"] + new["points"]},
+            )
+            records += pick(row, "id", "points")
+        return records
+
+    @statement(REGISTER_EVENT_RESULTS_SQL)
+    def _register_event_results(self, participants: list[int], winners: list[int]) -> list[Record]:
+        participated, won = set(participants), set(winners)
+        for id in participated | won:
+            self.users.insert(
+                {"id": id, "total_events": int(id in participated), "won_events": int(id in won)},
+                on_conflict=("id",),
+                update=lambda old, new: {
+                    "total_events": old["total_events"] + new["total_events"],
+                    "won_events": old["won_events"] + new["won_events"],
+                },
+            )
+        return []
+
+    # trophies
+
+    @statement(CREATE_TROPHY_SQL)
+    def _create_trophy(self, id: str, name: str) -> list[Record]:
+        self.trophies.insert({"id": id, "name": name})
+        return []
+
+    @statement(REMOVE_TROPHY_SQL)
+    def _remove_trophy(self, id: str) -> list[Record]:
+        for row in self.trophies.find(("id",), (id,)):
+            self.trophies.delete(row)
+        return []
+
+    @statement(TROPHY_EXISTS_SQL)
+    def _trophy_exists(self, id: str) -> list[Record]:
+        return [Record(exists=self.trophies.get(("id",), (id,)) is not None)]
+
+    @statement(GIVE_TROPHY_SQL)
+    def _give_trophy(self, id: int, trophy_id: str) -> list[Record]:
+        self.inventories.insert({"id": id, "trophy_id": trophy_id})
+        return []
+
+    @statement(GIVE_TROPHY_BULK_SQL)
+    def _give_trophy_bulk(self, ids: list[int], trophy_id: str) -> list[Record]:
+        for id in ids:
+            self.users.insert({"id": id}, on_conflict=())
+            self.inventories.insert({"id": id, "trophy_id": trophy_id}, on_conflict=())
+        return []
+
+    @statement(TAKE_TROPHY_SQL)
+    def _take_trophy(self, id: int, trophy_id: str) -> list[Record]:
+        for row in self.inventories.find(("id", "trophy_id"), (id, trophy_id)):
+            self.inventories.delete(row)
+        return []
+
+    # events
+
+    @statement(CREATE_EVENT_SQL)
+    def _create_event(self, id, name: str, channel_id: int, message_id: int) -> list[Record]:
+        self.events.insert(
+            {"id": id, "name": name, "registration_channel_id": channel_id, "registration_message_id": message_id}
+        )
+        return []
+
+    @statement(SELECT_EVENTS_SQL)
+    def _select_events(self) -> list[Record]:
+        return [Record(id=row["id"], name=row["name"]) for row in self.events]
+
+    @statement(EVENT_EXISTS_SQL)
+    def _event_exists(self, id) -> list[Record]:
+        return [Record(exists=self.events.get(("id",), (id,)) is not None)]
+
+    @statement(SELECT_REGISTRATION_SQL)
+    def _select_registration(self, id) -> list[Record]:
+        row = self.events.get(("id",), (id,))
+        if row is None:
+            return []
+        return [Record(channel_id=row["registration_channel_id"], message_id=row["registration_message_id"])]
+
+    @statement(SELECT_REGISTRATION_CHANNEL_SQL)
+    def _select_registration_channel(self, id) -> list[Record]:
+        return pick(self.events.get(("id",), (id,)), "registration_channel_id")
+
+    @statement(REMOVE_EVENT_SQL)
+    def _remove_event(self, id) -> list[Record]:
+        for row in self.events.find(("id",), (id,)):
+            self.events.delete(row)
+        return []
+
+    @statement(CREATE_GROUP_SQL)
+    def _create_group(self, event_id, start_time: datetime, role_id: int) -> list[Record]:
+        self.groups.insert({"event_id": event_id, "start_time": start_time, "role_id": role_id})
+        return []
+
+    @statement(CREATE_GROUPS_SQL)
+    def _create_groups(self, event_ids: list, role_ids: list[int], start_times: list[datetime]) -> list[Record]:
+        for event_id, role_id, start_time in zip(event_ids, role_ids, start_times):
+            self.groups.insert({"event_id": event_id, "start_time": start_time, "role_id": role_id})
+        return []
+
+    @statement(SELECT_GROUP_ROLES_SQL)
+    def _select_group_roles(self, event_id) -> list[Record]:
+        return [Record(role_id=row["role_id"]) for row in self.groups.find(("event_id",), (event_id,))]
+
+    @statement(SELECT_GROUPS_TO_CLOSE_SQL)
+    def _select_groups_to_close(self, now: datetime) -> list[Record]:
+        return [
+            Record(role_id=row["role_id"], event_id=row["event_id"])
+            for row in self.groups
+            if row["start_time"] < now and not row["closed"]
+        ]
+
+    @statement(CLOSE_GROUPS_SQL)
+    def _close_groups(self, now: datetime) -> list[Record]:
+        for row in self.groups:
+            if row["start_time"] < now and not row["closed"]:
+                self.groups.update(row, {"closed": True})
+        return []
+
+    # polls
+
+    @statement(CREATE_POLL_SQL)
+    def _create_poll(self, message_id: int) -> list[Record]:
+        self.polls_messages.insert({"message_id": message_id})
+        return []
+
+    @statement(SELECT_POLLS_SQL)
+    def _select_polls(self) -> list[Record]:
+        return [Record(message_id=row["message_id"]) for row in self.polls_messages]
+
+    @statement(REMOVE_POLLS_SQL)
+    def _remove_polls(self, message_ids: list[int]) -> list[Record]:
+        for message_id in message_ids:
+            for row in self.polls.find(("message_id",), (message_id,)):
+                self.polls.delete(row)
+            for row in self.polls_messages.find(("message_id",), (message_id,)):
+                self.polls_messages.delete(row)
+        return []
+
+    @statement(VOTE_SQL)
+    def _vote(self, message_id: int, option_id: int, member_id: int) -> list[Record]:
+        old = self.polls.get(("message_id", "member_id"), (message_id, member_id))
+        if old is None:
+            self.polls.insert({"message_id": message_id, "option_id": option_id, "member_id": member_id})
+            return [Record(old_option=None)]
+        if old["option_id"] == option_id:
+            return []
+        old_option = old["option_id"]
+        self.polls.update(old, {"option_id": option_id})
+        return [Record(old_option=old_option)]
+
+    @statement(COUNT_ALL_VOTES_SQL)
+    def _count_all_votes(self) -> list[Record]:
+        counts: dict[tuple[int, int], int] = {}
+        for row in self.polls:
+            key = (row["message_id"], row["option_id"])
+            counts[key] = counts.get(key, 0) + 1
+        return [Record(message_id=m, option_id=o, votes=votes) for (m, o), votes in counts.items()]
+
+    @statement(COUNT_POLL_VOTES_SQL)
+    def _count_poll_votes(self, message_id: int) -> list[Record]:
+        counts: dict[int, int] = {}
+        for row in self.polls.find(("message_id",), (message_id,)):
+            counts[row["option_id"]] = counts.get(row["option_id"], 0) + 1
+        return [Record(option_id=option_id, votes=votes) for option_id, votes in counts.items()]
+
+    # stats
+
+    @statement(RECORD_STATS_SQL)
+    def _record_stats(self, online: int, idle: int, dnd: int) -> list[Record]:
+        sample = self.stats.insert({"online": online, "idle": idle, "dnd": dnd})
+        for rollup in ROLLUPS:
+            values = {"bucket": rollup.truncate(sample["time"]), "samples": 1}
+            for column in STATS_COLUMNS:
+                values |= {
+                    f"{column}_min": sample[column],
+                    f"{column}_max": sample[column],
+                    f"{column}_sum": sample[column],
+                }
+            self.rollups[rollup.table].insert(values, ("bucket",), self._merge_buckets)
+        return []
+
+    @staticmethod
+    def _merge_buckets(existing: dict, excluded: dict) -> dict:
+        changes = {"samples": existing["samples"] + excluded["samples"]}
+        for column in STATS_COLUMNS:
+            changes[f"{column}_min"] = min(existing[f"{column}_min"], excluded[f"{column}_min"])
+            changes[f"{column}_max"] = max(existing[f"{column}_max"], excluded[f"{column}_max"])
+            changes[f"{column}_sum"] = existing[f"{column}_sum"] + excluded[f"{column}_sum"]
+        return changes
+
+    def _select_rollup(self, table: str, start: datetime, end: datetime) -> list[Record]:
+        rows = sorted((row for row in self.rollups[table] if start <= row["bucket"] <= end), key=lambda r: r["bucket"])
+        if not rows:
+            return [Record({"time": None} | {column: None for column in STATS_COLUMNS})]
+        record = Record(time=[int(epoch(row["bucket"])) for row in rows])
+        for column in STATS_COLUMNS:
+            record[column] = [row[f"{column}_sum"] // row["samples"] for row in rows]
+        return [record]
+
+    @statement(DELETE_OLD_STATS_SQL)
+    def _delete_old_stats(self, retention: timedelta) -> list[Record]:
+        cutoff = datetime.now() - retention
+        for row in self.stats:
+            if row["time"] < cutoff:
+                self.stats.delete(row)
+        return []
+
+    # tracking sessions
+
+    @statement(CREATE_SESSION_SQL)
+    def _create_tracking_session(self, channel_id: int, started_at: datetime) -> list[Record]:
+        self.tracking_sessions.insert({"channel_id": channel_id, "started_at": started_at})
+        return []
+
+    @statement(REMOVE_SESSION_SQL)
+    def _remove_tracking_session(self, channel_id: int) -> list[Record]:
+        for row in self.tracking_sessions.find(("channel_id",), (channel_id,)):
+            self.tracking_sessions.delete(row)
+        return []
+
+    @statement(SELECT_SESSIONS_SQL)
+    def _select_tracking_sessions(self) -> list[Record]:
+        return [r for row in self.tracking_sessions for r in pick(row, "channel_id", "started_at")]
+
+    @statement(SELECT_SESSION_USERS_SQL)
+    def _select_tracking_users(self) -> list[Record]:
+        return [r for row in self.tracking_users for r in pick(row, "channel_id", "user_id", "messages")]
+
+    @statement(SELECT_SESSION_MINUTES_SQL)
+    def _select_tracking_minutes(self) -> list[Record]:
+        return [r for row in self.tracking_minutes for r in pick(row, "channel_id", "minute", "messages")]
+
+    @statement(CHECKPOINT_SQL)
+    def _checkpoint_tracking(self, *columns: list) -> list[Record]:
+        def add(existing: dict, excluded: dict) -> dict:
+            return {"messages": existing["messages"] + excluded["messages"]}
+
+        for channel_id, user_id, messages in zip(*columns[:3]):
+            self.tracking_users.insert(
+                {"channel_id": channel_id, "user_id": user_id, "messages": messages}, ("channel_id", "user_id"), add
+            )
+        for channel_id, minute, messages in zip(*columns[3:]):
+            self.tracking_minutes.insert(
+                {"channel_id": channel_id, "minute": minute, "messages": messages}, ("channel_id", "minute"), add
+            )
+        return []
+
+
+def _rollup_selector(table: str) -> Callable[..., list[Record]]:
+    def select(self: MemoryDatabase, start: datetime, end: datetime) -> list[Record]:
+        return self._select_rollup(table, start, end)
+
+    return select
+
+
+for _rollup in ROLLUPS:
+    statement(_rollup.select_sql)(_rollup_selector(_rollup.table))
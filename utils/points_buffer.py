@@ -0,0 +1,122 @@
+import asyncio
+from typing import TYPE_CHECKING
+
+import asyncpg
+
+from utils.logs import Logger
+
+if TYPE_CHECKING:
+    from utils.database import Database
+
+FLUSH_SQL = (
+    "INSERT INTO users (id, points) SELECT * FROM unnest($1::BIGINT[], $2::INT[]) "
+    "ON CONFLICT (id) DO UPDATE SET points = users.points + EXCLUDED.points "
+    "RETURNING id, points"
+)
+SELECT_POINTS_OF_SQL = "SELECT id, points FROM users WHERE id = ANY($1::BIGINT[])"
+
+
+class PointsBuffer:
+    """
+    Write-behind buffer for event points.
+
+    Deltas are merged per user in memory and written as a single upsert every
+    ``interval`` seconds or as soon as ``threshold`` users are pending.
+    Leaderboard ranks are updated right away, so reads stay consistent.
+    """
+
+    def __init__(self, db: "Database", interval: float, threshold: int):
+        self.interval = interval
+        self.threshold = threshold
+        self._db = db
+        self._log = Logger("POINTS")
+        self._pending: dict[int, int] = {}  # user id -> points delta
+        self._inflight: dict[int, int] = {}  # deltas of the flush in progress, not in the table yet
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def pending(self, user_id: int) -> int:
+        return self._pending.get(user_id, 0) + self._inflight.get(user_id, 0)
+
+    def add(self, user_id: int, delta: int):
+        """:raise asyncpg.CheckViolationError: The user does not have enough points to subtract ``delta``."""
+        # ranks hold flushed points plus the pending deltas, i.e. the value the row will have after flush
+        if delta < 0 and self._db.ranks.get(user_id, 0) + delta < 0:
+            raise asyncpg.CheckViolationError(
+                'new row for relation "users" violates check constraint "users_points_check"'
+            )
+        self._pending[user_id] = self._pending.get(user_id, 0) + delta
+        self._db.ranks.add(user_id, delta)
+        self._db.users_cache.invalidate(user_id)
+        if len(self._pending) >= self.threshold:
+            self._wakeup.set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            # the loop exits after the flush it is in, cancelling it could lose that flush's deltas
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            self._inflight = pending
+            try:
+                rows = await self._db.fetchall(FLUSH_SQL, list(pending.keys()), list(pending.values()), background=True)
+            except (asyncpg.IntegrityConstraintViolationError, asyncpg.DataError):
+                # the data itself was rejected, retrying would fail forever
+                self._log.exception("Failed to flush points of %d users, the changes were dropped", len(pending))
+                self._inflight = {}
+                # ranks hold the dropped deltas, take them out first in case the points can't be read back
+                for user_id, delta in pending.items():
+                    self._db.ranks.set(user_id, self._db.ranks.get(user_id, 0) - delta)
+                try:
+                    rows = await self._db.fetchall(SELECT_POINTS_OF_SQL, list(pending.keys()), background=True)
+                except (OSError, asyncpg.InterfaceError, asyncpg.PostgresError):
+                    self._log.exception("Failed to read back points of %d users", len(pending))
+                    rows = []
+            except (OSError, asyncpg.InterfaceError, asyncpg.PostgresError):
+                # connection losses, restarts, deadlocks and the like, the write can succeed later
+                self._log.exception("Failed to flush points of %d users, will retry", len(pending))
+                self._restore(pending)
+                return
+            except BaseException:
+                self._restore(pending)
+                raise
+            finally:
+                self._inflight = {}
+
+            for row in rows:
+                # deltas accepted while the flush was in flight are not in the returned points yet
+                self._db.ranks.set(row["id"], (row["points"] or 0) + self._pending.get(row["id"], 0))
+            self._db.users_cache.invalidate_many(pending.keys())
+            self._log.debug("Flushed points of %d users", len(pending))
+
+    def _restore(self, pending: dict[int, int]):
+        for user_id, delta in pending.items():
+            self._pending[user_id] = self._pending.get(user_id, 0) + delta
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                self._log.exception("Unexpected error while flushing points")
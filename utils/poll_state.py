@@ -0,0 +1,68 @@
+from array import array
+from dataclasses import dataclass, field
+from typing import Sequence
+
+import disnake
+
+from utils.constants import ENUMERATION_EMOJIS
+
+CREATE_POLL_SQL = "INSERT INTO polls_messages (message_id) VALUES ($1)"
+SELECT_POLLS_SQL = "SELECT message_id FROM polls_messages"
+REMOVE_POLLS_SQL = (
+    "WITH votes AS (DELETE FROM polls WHERE message_id = ANY($1::BIGINT[])) "
+    "DELETE FROM polls_messages WHERE message_id = ANY($1::BIGINT[])"
+)
+# the CTE reads the row as it was before the upsert, the WHERE skips clicks on the already voted option
+VOTE_SQL = (
+    "WITH old AS (SELECT option_id FROM polls WHERE message_id = $1 AND member_id = $3) "
+    "INSERT INTO polls (message_id, option_id, member_id) VALUES ($1, $2, $3) "
+    "ON CONFLICT (message_id, member_id) DO UPDATE SET option_id = EXCLUDED.option_id "
+    "WHERE polls.option_id <> EXCLUDED.option_id "
+    "RETURNING (SELECT option_id FROM old) AS old_option"
+)
+COUNT_ALL_VOTES_SQL = "SELECT message_id, option_id, COUNT(*) AS votes FROM polls GROUP BY message_id, option_id"
+COUNT_POLL_VOTES_SQL = "SELECT option_id, COUNT(*) AS votes FROM polls WHERE message_id = $1 GROUP BY option_id"
+
+
+def votes_label(votes: int) -> str:
+    return f"{votes} vote{'' if votes == 1 else 's'}"
+
+
+def poll_view(votes: Sequence[int]) -> disnake.ui.View:
+    """Builds the buttons of a poll, one for each element of ``votes``."""
+    view = disnake.ui.View()
+    for i, (e, count) in enumerate(zip(ENUMERATION_EMOJIS, votes), 1):
+        view.add_item(
+            disnake.ui.Button(
+                style=disnake.ButtonStyle.blurple,
+                label=votes_label(count),
+                emoji=e,
+                custom_id=f"option-{i}",
+            )
+        )
+    return view
+
+
+def count_options(message: disnake.Message) -> int:
+    return sum(
+        1
+        for row in message.components
+        for component in row.children
+        if isinstance(component, disnake.Button) and (component.custom_id or "").startswith("option-")
+    )
+
+
+@dataclass(slots=True)
+class PollState:
+    message_id: int
+    channel_id: int = 0  # 0 and no options while unknown, both are filled in on the next vote
+    options: int = 0
+    tallies: array = field(default_factory=lambda: array("i", [0]) * len(ENUMERATION_EMOJIS))
+
+    def vote(self, option_id: int, old_option_id: int | None = None):
+        self.tallies[option_id - 1] += 1
+        if old_option_id is not None:
+            self.tallies[old_option_id - 1] -= 1
+
+    def view(self) -> disnake.ui.View:
+        return poll_view(self.tallies[: self.options])
@@ -0,0 +1,113 @@
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator
+
+import asyncpg
+
+from utils.logs import Logger
+
+
+@dataclass(frozen=True, slots=True)
+class PoolStats:
+    name: str
+    size: int
+    idle: int
+    max_size: int
+    waiting: int
+    acquisitions: int
+    avg_wait: float
+    max_wait: float
+
+    @property
+    def saturation(self) -> float:
+        """Share of the maximum pool size currently checked out."""
+        return (self.size - self.idle) / self.max_size
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name}: {self.size - self.idle}/{self.max_size} busy ({self.saturation:.0%}), "
+            f"{self.waiting} waiting, avg wait {self.avg_wait * 1000:.1f}ms, max wait {self.max_wait * 1000:.1f}ms"
+        )
+
+
+class Pool:
+    """
+    ``asyncpg.Pool`` wrapper that measures how long queries wait for a connection.
+
+    Waits of ``slow_wait`` seconds or longer log the pool stats as a warning, at most once per ``REPORT_INTERVAL``.
+    """
+
+    REPORT_INTERVAL = 60  # seconds
+
+    def __init__(self, name: str, pool: asyncpg.Pool, slow_wait: float):
+        self.name = name
+        self.slow_wait = slow_wait
+        self._pool = pool
+        self._log = Logger("DB")
+        self._last_report = float("-inf")
+        self._waiting = 0
+        self._acquisitions = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    @classmethod
+    async def create(cls, name: str, min_size: int, max_size: int, slow_wait: float, **connect_kwargs) -> "Pool":
+        # asyncpg opens min_size connections right away, so the pool is warm once this returns
+        pool = await asyncpg.create_pool(min_size=min_size, max_size=max_size, **connect_kwargs)
+        return cls(name, pool, slow_wait)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[asyncpg.Connection]:
+        self._waiting += 1
+        start = time.perf_counter()
+        try:
+            conn = await self._pool.acquire()
+        finally:
+            self._waiting -= 1
+        wait = time.perf_counter() - start
+        self._acquisitions += 1
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+        if wait >= self.slow_wait and start - self._last_report >= self.REPORT_INTERVAL:
+            self._last_report = start
+            self._log.warning("Waited %.0fms for a connection, pool %s", wait * 1000, self.stats())
+        try:
+            yield conn
+        finally:
+            await self._pool.release(conn)
+
+    async def execute(self, sql: str, *args) -> str:
+        async with self.acquire() as conn:
+            return await conn.execute(sql, *args)
+
+    async def executemany(self, sql: str, args) -> None:
+        async with self.acquire() as conn:
+            await conn.executemany(sql, args)
+
+    async def fetch(self, sql: str, *args) -> list[asyncpg.Record]:
+        async with self.acquire() as conn:
+            return await conn.fetch(sql, *args)
+
+    async def fetchrow(self, sql: str, *args) -> asyncpg.Record | None:
+        async with self.acquire() as conn:
+            return await conn.fetchrow(sql, *args)
+
+    async def fetchval(self, sql: str, *args) -> Any | None:
+        async with self.acquire() as conn:
+            return await conn.fetchval(sql, *args)
+
+    async def close(self):
+        await self._pool.close()
+
+    def stats(self) -> PoolStats:
+        return PoolStats(
+            name=self.name,
+            size=self._pool.get_size(),
+            idle=self._pool.get_idle_size(),
+            max_size=self._pool.get_max_size(),
+            waiting=self._waiting,
+            acquisitions=self._acquisitions,
+            avg_wait=self._total_wait / self._acquisitions if self._acquisitions else 0.0,
+            max_wait=self._max_wait,
+        )
@@ -0,0 +1,111 @@
+from bisect import bisect_left, insort
+from typing import Iterable
+
+BUCKET_SIZE = 512
+
+
+class RankIndex:
+    """
+    Order-statistic multiset over users' event points.
+
+    Points are kept in sorted buckets; a Fenwick tree over bucket lengths makes
+    ``rank`` O(log n) while updates only shift a single small bucket.
+    """
+
+    def __init__(self):
+        self._points: dict[int, int] = {}  # user id -> points
+        self._buckets: list[list[int]] = []
+        self._maxes: list[int] = []  # last (biggest) value of each bucket
+        self._tree: list[int] = [0]  # 1-based Fenwick tree over bucket lengths
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._points
+
+    def get(self, user_id: int, default: int | None = None) -> int | None:
+        return self._points.get(user_id, default)
+
+    def load(self, rows: Iterable[tuple[int, int]]):
+        """:param rows: (user_id, points)"""
+        self._points = {user_id: points or 0 for user_id, points in rows}
+        values = sorted(self._points.values())
+        self._buckets = [values[i : i + BUCKET_SIZE] for i in range(0, len(values), BUCKET_SIZE)]
+        self._rebuild()
+
+    def set(self, user_id: int, points: int):
+        old = self._points.get(user_id)
+        if old == points:
+            return
+        if old is not None:
+            self._remove(old)
+        self._points[user_id] = points
+        self._insert(points)
+
+    def add(self, user_id: int, delta: int):
+        self.set(user_id, self._points.get(user_id, 0) + delta)
+
+    def discard(self, user_id: int):
+        old = self._points.pop(user_id, None)
+        if old is not None:
+            self._remove(old)
+
+    def rank(self, points: int) -> int:
+        """Returns amount of users having at least ``points`` points."""
+        i = bisect_left(self._maxes, points)
+        if i == len(self._buckets):
+            return 0
+        below = self._prefix(i) + bisect_left(self._buckets[i], points)
+        return len(self._points) - below
+
+    def _rebuild(self):
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        n = len(self._buckets)
+        tree = [0] * (n + 1)
+        for i, bucket in enumerate(self._buckets, 1):
+            tree[i] += len(bucket)
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _prefix(self, i: int) -> int:
+        """Total length of the first ``i`` buckets."""
+        total = 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _tree_add(self, i: int, delta: int):
+        i += 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _insert(self, value: int):
+        if not self._buckets:
+            self._buckets.append([value])
+            self._rebuild()
+            return
+        i = min(bisect_left(self._maxes, value), len(self._buckets) - 1)
+        bucket = self._buckets[i]
+        insort(bucket, value)
+        self._maxes[i] = bucket[-1]
+        if len(bucket) > BUCKET_SIZE * 2:
+            self._buckets[i : i + 1] = [bucket[:BUCKET_SIZE], bucket[BUCKET_SIZE:]]
+            self._rebuild()
+        else:
+            self._tree_add(i, 1)
+
+    def _remove(self, value: int):
+        i = bisect_left(self._maxes, value)
+        bucket = self._buckets[i]
+        del bucket[bisect_left(bucket, value)]
+        if bucket:
+            self._maxes[i] = bucket[-1]
+            self._tree_add(i, -1)
+        else:
+            del self._buckets[i]
+            self._rebuild()
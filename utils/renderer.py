@@ -0,0 +1,67 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class RendererBusy(Exception):
+    """Raised when the renderer already has ``queue_size`` jobs in flight."""
+
+
+def _init_worker():
+    # resolving this initializer imports its module and everything the render functions need,
+    # so fonts and templates are loaded when a worker starts rather than on its first job
+    import utils.image_generation  # noqa: F401
+
+
+class Renderer:
+    """
+    Dedicated executor for image rendering, kept apart from the event loop's default thread pool.
+
+    With the ``process`` backend renders run in parallel across cores instead of contending for the GIL,
+    so render functions and their arguments have to be picklable. Jobs beyond ``queue_size`` are rejected
+    right away with ``RendererBusy`` instead of piling up behind a long queue.
+    """
+
+    def __init__(self, backend: str, workers: int, queue_size: int):
+        if backend not in ("process", "thread"):
+            raise ValueError(f"Unknown render backend {backend!r}")
+        self.backend = backend
+        self.workers = workers
+        self.queue_size = queue_size
+        self.in_flight = 0
+        self._executor: Executor | None = None  # created on first use, never in the workers themselves
+
+    @classmethod
+    def from_env(cls) -> "Renderer":
+        workers = int(os.getenv("RENDER_WORKERS", min(4, os.cpu_count() or 1)))
+        return cls(os.getenv("RENDER_BACKEND", "process"), workers, int(os.getenv("RENDER_QUEUE_SIZE", workers * 4)))
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.backend == "process":
+                # spawned workers do not inherit the threads and sockets of the bot process
+                self._executor = ProcessPoolExecutor(
+                    self.workers, multiprocessing.get_context("spawn"), initializer=_init_worker
+                )
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, "render")
+        return self._executor
+
+    async def submit(self, func: Callable[..., T], *args) -> T:
+        """:raise RendererBusy: Too many jobs are in flight."""
+        if self.in_flight >= self.queue_size:
+            raise RendererBusy(f"{self.in_flight} renders are in flight")
+        self.in_flight += 1
+        try:
+            return await asyncio.get_event_loop().run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.in_flight -= 1
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,80 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+STATS_COLUMNS = ("online", "idle", "dnd")
+
+
+@dataclass(frozen=True, slots=True)
+class Rollup:
+    """
+    A table of ``stats`` aggregated into buckets of ``date_trunc(unit, time)``.
+
+    Buckets keep the sample count and the minimum, maximum and sum of every column, so they can be
+    updated one sample at a time and averaged on read.
+    """
+
+    table: str
+    unit: str
+    width: timedelta
+
+    def truncate(self, time: datetime) -> datetime:
+        """Same as ``date_trunc(unit, time)``, weeks start on Monday."""
+        time = time.replace(minute=0, second=0, microsecond=0)
+        if self.unit == "hour":
+            return time
+        time = time.replace(hour=0)
+        if self.unit == "day":
+            return time
+        return time - timedelta(days=time.weekday())
+
+    @property
+    def upsert_sql(self) -> str:
+        """Adds the samples of the ``sample`` CTE to their buckets."""
+        columns = ", ".join(f"{c}_min, {c}_max, {c}_sum" for c in STATS_COLUMNS)
+        values = ", ".join(f"{c}, {c}, {c}" for c in STATS_COLUMNS)
+        updates = ", ".join(
+            f"{c}_min = LEAST({self.table}.{c}_min, EXCLUDED.{c}_min), "
+            f"{c}_max = GREATEST({self.table}.{c}_max, EXCLUDED.{c}_max), "
+            f"{c}_sum = {self.table}.{c}_sum + EXCLUDED.{c}_sum"
+            for c in STATS_COLUMNS
+        )
+        return (
+            f"INSERT INTO {self.table} (bucket, samples, {columns}) "
+            f"SELECT date_trunc('{self.unit}', time), 1, {values} FROM sample "
+            f"ON CONFLICT (bucket) DO UPDATE SET samples = {self.table}.samples + EXCLUDED.samples, {updates}"
+        )
+
+    @property
+    def select_sql(self) -> str:
+        """Bucket averages between $1 and $2 as arrays, in the same shape as a ``stats`` query."""
+        averages = ", ".join(f"array_agg({c}_sum / samples ORDER BY bucket) AS {c}" for c in STATS_COLUMNS)
+        return (
+            f"SELECT array_agg(EXTRACT(EPOCH FROM bucket)::BIGINT ORDER BY bucket) AS time, {averages} "
+            f"FROM {self.table} WHERE bucket BETWEEN $1 AND $2"
+        )
+
+
+# from the finest to the coarsest
+ROLLUPS = (
+    Rollup("stats_hourly", "hour", timedelta(hours=1)),
+    Rollup("stats_daily", "day", timedelta(days=1)),
+    Rollup("stats_weekly", "week", timedelta(weeks=1)),
+)
+
+# the sample is rolled up in the same statement, so the rollups can't miss or double count it
+RECORD_STATS_SQL = (
+    "WITH sample AS (INSERT INTO stats (online, idle, dnd) VALUES ($1, $2, $3) RETURNING time, online, idle, dnd), "
+    + ", ".join(f"{rollup.unit}_rollup AS ({rollup.upsert_sql})" for rollup in ROLLUPS[:-1])
+    + f" {ROLLUPS[-1].upsert_sql}"
+)
+
+
+DELETE_OLD_STATS_SQL = "DELETE FROM stats WHERE time < LOCALTIMESTAMP - $1::INTERVAL"
+
+
+def pick_rollup(start: datetime, end: datetime, max_points: int) -> Rollup:
+    """Returns the finest rollup that has at most ``max_points`` buckets between ``start`` and ``end``."""
+    for rollup in ROLLUPS:
+        if (end - start) / rollup.width <= max_points:
+            return rollup
+    return ROLLUPS[-1]
@@ -1,37 +1,219 @@
+import time
+from array import array
+from operator import add
+from typing import Iterator
+
 import disnake
 import pendulum
 
 from utils.logs import Logger
 
+CREATE_SESSION_SQL = "INSERT INTO tracking_sessions (channel_id, started_at) VALUES ($1, $2)"
+REMOVE_SESSION_SQL = "DELETE FROM tracking_sessions WHERE channel_id = $1"
+SELECT_SESSIONS_SQL = "SELECT channel_id, started_at FROM tracking_sessions"
+SELECT_SESSION_USERS_SQL = "SELECT channel_id, user_id, messages FROM tracking_users"
+SELECT_SESSION_MINUTES_SQL = "SELECT channel_id, minute, messages FROM tracking_minutes"
+# adds the changes since the last checkpoint, users and minutes are passed as columns for unnest
+CHECKPOINT_SQL = (
+    "WITH users AS (INSERT INTO tracking_users (channel_id, user_id, messages) "
+    "SELECT * FROM unnest($1::BIGINT[], $2::BIGINT[], $3::INT[]) "
+    "ON CONFLICT (channel_id, user_id) DO UPDATE SET messages = tracking_users.messages + EXCLUDED.messages) "
+    "INSERT INTO tracking_minutes (channel_id, minute, messages) "
+    "SELECT * FROM unnest($4::BIGINT[], $5::INT[], $6::INT[]) "
+    "ON CONFLICT (channel_id, minute) DO UPDATE SET messages = tracking_minutes.messages + EXCLUDED.messages"
+)
+
+
+class Timeline:
+    """
+    Amounts of messages per time bucket, measured on the monotonic clock.
+
+    Buckets are a minute wide, when a session outlasts ``capacity`` buckets, neighbouring
+    buckets are merged pairwise and their width doubles, so memory stays fixed however long it runs.
+    """
+
+    CAPACITY = 1440
+
+    def __init__(self, capacity: int = CAPACITY, elapsed: float = 0):
+        """:param elapsed: Seconds the timeline has been running for already, e.g. before a restart."""
+        self.started_at = time.monotonic() - elapsed
+        self.width = 60  # seconds
+        self.counts = array("I", [0]) * capacity
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def register(self) -> float:
+        """Counts a message at the current time and returns that time as seconds since the start."""
+        elapsed = self.elapsed
+        self.add(elapsed)
+        return elapsed
+
+    def add(self, seconds: float, count: int = 1):
+        i = int(seconds // self.width)
+        while i >= len(self.counts):
+            self._merge()
+            i //= 2
+        self.counts[i] += count
+
+    def rate(self, window: float = 300) -> float:
+        """Messages per minute over the last ``window`` seconds, rounded out to whole buckets."""
+        elapsed = self.elapsed
+        first = max(0, int((elapsed - window) // self.width))
+        last = int(elapsed // self.width)
+        span = max(elapsed - first * self.width, 1)
+        return sum(self.counts[first : last + 1]) / span * 60
+
+    def _merge(self):
+        half = len(self.counts) // 2
+        self.counts[:half] = array("I", map(add, self.counts[0::2], self.counts[1::2]))
+        self.counts[half:] = array("I", [0]) * (len(self.counts) - half)
+        self.width *= 2
+
+
+class _Bucket:
+    __slots__ = ("count", "keys", "prev", "next")
+
+    def __init__(self, count: int):
+        self.count = count
+        self.keys: dict[int, None] = {}  # insertion ordered set, the first to reach the count comes first
+        self.prev: _Bucket | None = None  # bucket with the next lower count
+        self.next: _Bucket | None = None  # bucket with the next higher count
+
+
+class CountBuckets:
+    """
+    Counters that only go up, kept ordered for top-k queries.
+
+    Keys with equal counts share a bucket in a linked list sorted by count. An increment moves
+    its key to the neighbouring bucket, and ``top(k)`` walks down from the highest bucket,
+    so both cost O(1) per key instead of sorting all counters.
+    """
+
+    def __init__(self):
+        self._buckets: dict[int, _Bucket] = {}  # key -> its bucket
+        self._head: _Bucket | None = None  # lowest count
+        self._tail: _Bucket | None = None  # highest count
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def get(self, key: int, default: int = 0) -> int:
+        bucket = self._buckets.get(key)
+        return default if bucket is None else bucket.count
+
+    def items(self) -> Iterator[tuple[int, int]]:
+        for key, bucket in self._buckets.items():
+            yield key, bucket.count
+
+    def increment(self, key: int, amount: int = 1):
+        bucket = self._buckets.get(key)
+        count = (0 if bucket is None else bucket.count) + amount
+        # the target bucket is right after the current one, unless the key skips counts with amount > 1
+        prev, target = bucket, self._head if bucket is None else bucket.next
+        while target is not None and target.count < count:
+            prev, target = target, target.next
+        if target is None or target.count != count:
+            target = self._insert_after(prev, count)
+        target.keys[key] = None
+        self._buckets[key] = target
+        if bucket is not None:
+            del bucket.keys[key]
+            if not bucket.keys:
+                self._unlink(bucket)
+
+    def top(self, k: int) -> list[tuple[int, int]]:
+        """The ``k`` keys with the highest counts as (key, count), highest first."""
+        result = []
+        bucket = self._tail
+        while bucket is not None and len(result) < k:
+            for key in bucket.keys:
+                result.append((key, bucket.count))
+                if len(result) == k:
+                    break
+            bucket = bucket.prev
+        return result
+
+    def _insert_after(self, prev: _Bucket | None, count: int) -> _Bucket:
+        bucket = _Bucket(count)
+        bucket.prev = prev
+        bucket.next = self._head if prev is None else prev.next
+        if bucket.next is None:
+            self._tail = bucket
+        else:
+            bucket.next.prev = bucket
+        if prev is None:
+            self._head = bucket
+        else:
+            prev.next = bucket
+        return bucket
+
+    def _unlink(self, bucket: _Bucket):
+        if bucket.prev is None:
+            self._head = bucket.next
+        else:
+            bucket.prev.next = bucket.next
+        if bucket.next is None:
+            self._tail = bucket.prev
+        else:
+            bucket.next.prev = bucket.prev
+
 
 class Session:
-    def __init__(self, channel: disnake.TextChannel):
+    def __init__(self, channel: disnake.TextChannel, started_at: pendulum.DateTime | None = None):
+        """:param started_at: Start of a session that is restored from a checkpoint."""
+        self.channel_id = channel.id
         self.total_messages: int = 0
-        self.started_at = pendulum.now()
-        self.users: dict[int, int] = {}  # a dict where keys are user IDs and values are amounts of their messages
-        self.stats: list[int] = []  # list with amount of messages for each minute
+        self.started_at = started_at or pendulum.now()
+        self.users = CountBuckets()  # amounts of messages by user ID
+        self.timeline = Timeline(elapsed=(pendulum.now() - self.started_at).total_seconds())
+        # changes since the last checkpoint, by user ID and by minute since the start
+        self._new_users: dict[int, int] = {}
+        self._new_minutes: dict[int, int] = {}
         self.id = f"{channel.name}-{int(self.started_at.timestamp())}"
         self.log = Logger("session-" + self.id)
-        self.log.info(f"Initiated track session for channel {channel.id}")
+        if started_at is None:
+            self.log.info(f"Initiated track session for channel {channel.id}")
+        else:
+            self.log.info(f"Restored track session for channel {channel.id}")
 
     @property
     def total_participants(self) -> int:
         return len(self.users)
 
-    def register_message(self, msg: disnake.Message):
-        current_minute: int = (pendulum.now() - self.started_at).seconds // 60
-        registered_minutes = len(self.stats) - 1
-        if registered_minutes == current_minute:
-            self.stats[current_minute] += 1
-        else:
-            self.stats += [0] * (current_minute - len(self.stats) + 1)
-            self.stats.append(1)
+    @property
+    def duration(self) -> float:
+        """Seconds since the session started, not affected by changes of the system clock."""
+        return self.timeline.elapsed
 
-        self.users[msg.author.id] = self.users.get(msg.author.id, 0) + 1
+    def register_message(self, msg: disnake.Message):
+        minute = int(self.timeline.register() // 60)
+        self.users.increment(msg.author.id)
         self.total_messages += 1
+        self._new_minutes[minute] = self._new_minutes.get(minute, 0) + 1
+        self._new_users[msg.author.id] = self._new_users.get(msg.author.id, 0) + 1
+
+    def take_changes(self) -> tuple[dict[int, int], dict[int, int]]:
+        """Returns the message counts by user ID and by minute since the last call."""
+        changes = self._new_users, self._new_minutes
+        self._new_users, self._new_minutes = {}, {}
+        return changes
+
+    def return_changes(self, users: dict[int, int], minutes: dict[int, int]):
+        """Puts back changes that failed to be saved, so they are part of the next ``take_changes``."""
+        for user_id, count in users.items():
+            self._new_users[user_id] = self._new_users.get(user_id, 0) + count
+        for minute, count in minutes.items():
+            self._new_minutes[minute] = self._new_minutes.get(minute, 0) + count
+
+    def restore(self, users: dict[int, int], minutes: dict[int, int]):
+        """Loads message counts of a checkpoint, by user ID and by minute since the start."""
+        for user_id, count in users.items():
+            self.users.increment(user_id, count)
+            self.total_messages += count
+        for minute, count in minutes.items():
+            self.timeline.add(minute * 60, count)
 
     def get_top_users(self, limit) -> list[int]:
-        # noinspection PyTypeChecker
-        users: list[tuple[int, int]] = list(self.users.items())
-        users.sort(key=lambda e: e[1], reverse=True)
-        return [i[0] for i in users[:limit]]
+        return [user_id for user_id, _ in self.users.top(limit)]
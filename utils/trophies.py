@@ -0,0 +1,54 @@
+import os
+import threading
+from pathlib import Path
+
+from PIL import Image
+
+from utils.cache import LRUCache
+
+TROPHY_SIZE = (130, 130)
+
+
+class TrophyThumbnails:
+    """
+    Thread-safe cache of trophy pictures resized to ``TROPHY_SIZE`` in RGBA, so they are their own paste mask.
+
+    Thumbnails are checked against the modification time of the picture, a replaced picture is loaded again.
+    """
+
+    PATH = Path("data/trophies")
+    MEMORY_LIMIT = 16 * 1024 * 1024  # bytes of pixel data
+
+    def __init__(self):
+        self._cache: LRUCache[str, tuple[float, Image.Image]] = LRUCache(
+            self.MEMORY_LIMIT, sizeof=lambda entry: entry[1].width * entry[1].height * 4
+        )
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        """Changes whenever a trophy picture is dropped, i.e. created or removed."""
+        return self._cache.generation
+
+    def get(self, trophy_id: str) -> Image.Image:
+        path = self.PATH / f"{trophy_id}.png"
+        mtime = os.stat(path).st_mtime
+        with self._lock:
+            entry = self._cache.get(trophy_id)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+        with Image.open(path) as img:
+            thumbnail = img.convert("RGBA").resize(TROPHY_SIZE)
+        with self._lock:
+            self._cache.set(trophy_id, (mtime, thumbnail))
+        return thumbnail
+
+    def drop(self, trophy_id: str):
+        # only clears the cache of the calling process, render workers have their own copy of this cache,
+        # there a replaced picture is caught by its new mtime and a removed one is no longer found on disk
+        with self._lock:
+            self._cache.invalidate(trophy_id)
+
+
+trophy_thumbnails = TrophyThumbnails()
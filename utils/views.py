@@ -4,6 +4,8 @@ from typing import TYPE_CHECKING, Callable
 
 import disnake
 
+from utils.database import TROPHY_EXISTS_SQL
+
 if TYPE_CHECKING:
     from utils.bot import Bot
 
@@ -63,13 +65,7 @@ class EventEndView(disnake.ui.View):
             await interaction.message.edit(view=self)
             await interaction.response.defer()
             bot: "Bot" = interaction.bot
-            # noinspection PyTypeChecker
-            dt = list(map(lambda x: (x, points), self.participants))
-            await bot.db.executemany(
-                "INSERT INTO users (id, points) "
-                "VALUES ($1, $2) ON CONFLICT (id) DO UPDATE SET points = users.points + $2",
-                dt,
-            )
+            await bot.db.add_points_bulk(self.participants, points)
             await interaction.send("Successfully added points to all participants")
 
         await inter.response.send_modal(
@@ -86,17 +82,14 @@ class EventEndView(disnake.ui.View):
             data = interaction.text_values
             bot: "Bot" = interaction.bot
             id = data["id"].strip().lower()
-            trophy_exists = await bot.db.fetchval("SELECT EXISTS(SELECT 1 FROM trophies WHERE id = $1)", id)
+            trophy_exists = await bot.db.fetchval(TROPHY_EXISTS_SQL, id)
             if not trophy_exists:
                 await interaction.send(f"Trophy with id `{id}` does not exist", ephemeral=True)
                 return
             button.disabled = True
             await interaction.message.edit(view=self)
             await interaction.response.defer()
-            await bot.db.executemany(
-                "INSERT INTO inventories (id, trophy_id) VALUES ($1, $2) ON CONFLICT DO NOTHING",
-                [(i, id) for i in self.participants],
-            )
+            await bot.db.give_trophy_bulk(self.participants, id)
             await interaction.send("Successfully added this trophy to all participants")
 
         await inter.response.send_modal(
@@ -133,13 +126,7 @@ class EventEndView(disnake.ui.View):
             await interaction.message.edit(view=self)
             await interaction.response.defer()
             bot: "Bot" = interaction.bot
-            # noinspection PyTypeChecker
-            dt = list(map(lambda x: (x, points), self.winners))
-            await bot.db.executemany(
-                "INSERT INTO users (id, points) VALUES ($1, $2) "
-                "ON CONFLICT (id) DO UPDATE SET points = users.points + $2",
-                dt,
-            )
+            await bot.db.add_points_bulk(self.winners, points)
             await interaction.send("Successfully added points to all winners")
 
         await inter.response.send_modal(
@@ -162,17 +149,14 @@ class EventEndView(disnake.ui.View):
             data = interaction.text_values
             bot: "Bot" = interaction.bot
             id = data["id"].strip().lower()
-            trophy_exists = await bot.db.fetchval("SELECT EXISTS(SELECT 1 FROM trophies WHERE id = $1)", id)
+            trophy_exists = await bot.db.fetchval(TROPHY_EXISTS_SQL, id)
             if not trophy_exists:
                 await interaction.send(f"Trophy with id `{id}` does not exist", ephemeral=True)
                 return
             button.disabled = True
             await interaction.message.edit(view=self)
             await interaction.response.defer()
-            await bot.db.executemany(
-                "INSERT INTO inventories (id, trophy_id) VALUES ($1, $2) ON CONFLICT DO NOTHING",
-                [(i, id) for i in self.winners],
-            )
+            await bot.db.give_trophy_bulk(self.winners, id)
             await interaction.send("Successfully added this trophy to all winners")
 
         await inter.response.send_modal(
@@ -196,15 +180,7 @@ class EventEndView(disnake.ui.View):
         await inter.message.delete()
         await inter.response.defer()
         bot: "Bot" = inter.bot
-        await bot.db.executemany(
-            "INSERT INTO users (id, total_events) VALUES ($1, 1) "
-            "ON CONFLICT (id) DO UPDATE SET total_events = users.total_events + 1",
-            [(x,) for x in self.participants],
-        )
-        await bot.db.execute(
-            "UPDATE users SET won_events = won_events + 1 WHERE id = ANY($1::BIGINT[])",
-            self.winners,
-        )
+        await bot.db.register_event_results(self.participants, self.winners)
         await inter.send("Event was ended. Please use `/removeevent` command for cleanup")
 
 